@@ -11,6 +11,7 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
+from string import Template
 
 # Import custom modules
 from src.data_processing.data_loader import load_and_process
@@ -31,6 +32,21 @@ DATA_PATH = "project2.csv"
 PROCESSED_DATA_PATH = "data/processed_customer_features.csv"
 MODEL_PATH = "models/segmentation_model"
 
+# HTML templates for the profile cards. They are kept on a single line so that
+# markdown doesn't treat indented HTML as a code block.
+PROFILE_INFO_ITEM_TEMPLATE = Template(
+    '<div class="profile-info-item"><div class="profile-info-label">$label:</div>'
+    '<div class="profile-info-value">$value</div></div>'
+)
+METRIC_CARD_TEMPLATE = Template(
+    '<div class="metric-card"><div class="metric-value">$value</div>'
+    '<div class="metric-label">$label</div></div>'
+)
+RECOMMENDATION_CARD_TEMPLATE = Template(
+    '<div class="recommendation-card"><div class="recommendation-title">$title</div>'
+    '<div class="recommendation-text">$text</div></div>'
+)
+
 # Custom CSS
 def load_css():
     st.markdown("""
@@ -204,6 +220,13 @@ def load_css():
             text-overflow: ellipsis;
         }
         
+        /* Metric Cards Grid */
+        .metrics-container {
+            display: grid;
+            grid-template-columns: repeat(4, 1fr);
+            gap: 1rem;
+        }
+        
         /* Stats Container */
         .stats-container {
             display: grid;
@@ -255,6 +278,11 @@ def load_css():
         }
         
         /* Recommendation Cards */
+        .recommendation-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
+            gap: 1rem;
+        }
         .recommendation-card {
             background-color: var(--dark-card);
             border-radius: 10px;
@@ -535,7 +563,7 @@ def load_css():
             }
         }
         @media (max-width: 768px) {
-            .stats-container {
+            .stats-container, .metrics-container {
                 grid-template-columns: repeat(2, 1fr);
             }
         }
@@ -549,26 +577,46 @@ def load_css():
                 margin-right: 0;
                 margin-bottom: 1rem;
             }
-            .stats-container {
+            .stats-container, .metrics-container {
                 grid-template-columns: 1fr;
             }
         }
     </style>
     """, unsafe_allow_html=True)
 
-# Function to load data
-@st.cache_data
-def load_cached_data():
+# Repeated string columns stored as pandas categoricals after loading
+TRANSACTION_CATEGORICAL_COLUMNS = ['category', 'city', 'payment_method', 'shopping_mall']
+CUSTOMER_CATEGORICAL_COLUMNS = ['city', 'primary_category']
+
+# Function to convert repeated string columns to categoricals
+def to_categorical(df, columns):
+    for col in columns:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+# Function to get a cheap version key for the source data files (their modification times)
+def get_data_version():
+    return tuple(
+        os.path.getmtime(path) if os.path.exists(path) else None
+        for path in (DATA_PATH, PROCESSED_DATA_PATH)
+    )
+
+# Function to load data (reloaded whenever the data version changes)
+@st.cache_data(max_entries=1)
+def load_cached_data(data_version):
     if os.path.exists(PROCESSED_DATA_PATH):
         # Load processed data if it exists
         customer_features = pd.read_csv(PROCESSED_DATA_PATH, index_col=0)
         transactions_df, _ = load_and_process(DATA_PATH)
-        return transactions_df, customer_features
     else:
         # Process data if processed data doesn't exist
         os.makedirs(os.path.dirname(PROCESSED_DATA_PATH), exist_ok=True)
         transactions_df, customer_features = load_and_process(DATA_PATH, PROCESSED_DATA_PATH)
-        return transactions_df, customer_features
+    
+    transactions_df = to_categorical(transactions_df, TRANSACTION_CATEGORICAL_COLUMNS)
+    customer_features = to_categorical(customer_features, CUSTOMER_CATEGORICAL_COLUMNS)
+    return transactions_df, customer_features
 
 # Function to load segmentation model
 @st.cache_resource
@@ -581,6 +629,122 @@ def load_model():
         st.error("Segmentation model not found. Please run the main page first to train the model.")
         return None
 
+# Chart figures below are cached per customer ID and data version. Their data is derived
+# from the cached loader output for that customer, so it is passed unhashed (leading underscore).
+CHART_CACHE_MAX_ENTRIES = 64
+
+# Function to build the monthly spending trend chart
+@st.cache_resource(max_entries=CHART_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_monthly_spending_chart(customer_id, data_version, _monthly_spend):
+    fig = px.line(
+        _monthly_spend,
+        x='invoice_date',
+        y='total_amount',
+        title='Monthly Spending Trends',
+        labels={'invoice_date': 'Month', 'total_amount': 'Total Spend (₹)'},
+        markers=True
+    )
+    
+    fig.update_layout(
+        xaxis_title='Month',
+        yaxis_title='Total Spend (₹)',
+        xaxis=dict(tickangle=45),
+        legend=dict(bgcolor='rgba(0,0,0,0)')  # Add transparent legend background
+    )
+    return fig
+
+# Function to build a category spending pie chart
+@st.cache_resource(max_entries=CHART_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_category_pie_chart(customer_id, data_version, _category_data, values, title):
+    fig = px.pie(
+        _category_data,
+        values=values,
+        names='Category',
+        title=title
+    )
+    fig.update_layout(legend=dict(bgcolor='rgba(0,0,0,0)'))
+    return fig
+
+# Function to build the top purchased products chart
+@st.cache_resource(max_entries=CHART_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_top_products_chart(customer_id, data_version, _top_products):
+    fig = px.bar(
+        x=_top_products.index,
+        y=_top_products.values,
+        title='Top Purchased Products',
+        labels={'x': 'Product', 'y': 'Purchase Count'}
+    )
+    
+    # Add transparent legend background
+    fig.update_layout(
+        legend=dict(bgcolor='rgba(0,0,0,0)')
+    )
+    return fig
+
+# Function to get all customers as a dict of dicts keyed by customer ID
+# (cache_resource returns the same dict on every rerun instead of an unpickled copy;
+# keyed on the data version so the frame itself is never hashed)
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_customer_records(data_version, _customer_data):
+    return _customer_data.to_dict(orient='index')
+
+# Function to build the customer location data used by the maps
+@st.cache_data(show_spinner=False)
+def build_mapping_data(customer_data):
+    # Create a DataFrame for mapping customer locations
+    mapping_data = pd.DataFrame(index=customer_data.index)
+    
+    # Add segment information for coloring
+    if 'segment_name' in customer_data.columns:
+        mapping_data['segment_name'] = customer_data['segment_name'].values
+    else:
+        mapping_data['segment_name'] = 'Unknown'
+    
+    # Clean and prepare city data for mapping
+    mapping_data['city'] = 'Unknown'  # Set default value
+    
+    # Extract city from location if it exists
+    if 'location' in customer_data.columns and pd.notna(customer_data['location']).any():
+        for idx, row in customer_data.iterrows():
+            if pd.notna(row.get('location')):
+                city = str(row['location']).split(',')[0].strip()
+                if city and city != 'Unknown':
+                    mapping_data.at[idx, 'city'] = city
+    
+    # Handle one-hot encoded city columns
+    elif any(col.startswith('city_') for col in customer_data.columns):
+        city_columns = [col for col in customer_data.columns if col.startswith('city_')]
+        
+        for idx, row in customer_data.iterrows():
+            for city_col in city_columns:
+                if pd.notna(row.get(city_col)) and row.get(city_col) == 1:
+                    city_name = city_col.replace('city_', '')
+                    mapping_data.at[idx, 'city'] = city_name
+    
+    # Use direct city column if available
+    elif 'city' in customer_data.columns:
+        for idx, row in customer_data.iterrows():
+            if pd.notna(row.get('city')):
+                mapping_data.at[idx, 'city'] = row['city']
+    
+    return mapping_data
+
+# Function to build the map of all customers
+@st.cache_resource(show_spinner=False)
+def build_all_customers_map(mapping_data):
+    return create_customer_location_map(mapping_data)
+
+# Function to build the map of customers in a single segment
+@st.cache_data(show_spinner=False)
+def build_segment_map(mapping_data, segment_name):
+    segment_customers = mapping_data
+    
+    # Filter for customers in the same segment, if we have multiple customers
+    if len(mapping_data) > 1 and 'segment_name' in mapping_data.columns:
+        segment_customers = mapping_data[mapping_data['segment_name'] == segment_name]
+    
+    return create_customer_location_map(segment_customers)
+
 # Function to generate customer avatar
 def generate_avatar(customer_id, first_name):
     if first_name:
@@ -594,6 +758,35 @@ def generate_avatar(customer_id, first_name):
     </div>
     """
 
+# Function to format a purchase date for the profile card
+def format_purchase_date(value):
+    try:
+        # Handle invalid date values
+        if pd.notna(value) and value != 0 and value != '0':
+            purchase_date = pd.to_datetime(value, errors='coerce')
+            if pd.notna(purchase_date):
+                return purchase_date.strftime('%B %d, %Y')
+    except (ValueError, TypeError):
+        pass
+    
+    return "Not available"
+
+# Function to render a list of (label, value) pairs as profile info items
+def render_profile_info(info_items):
+    items_html = "".join(
+        PROFILE_INFO_ITEM_TEMPLATE.substitute(label=label, value=value)
+        for label, value in info_items
+    )
+    return f'<div class="profile-info">{items_html}</div>'
+
+# Function to render recommendation/offer cards as a single grid
+def render_recommendation_cards(cards):
+    cards_html = "".join(
+        RECOMMENDATION_CARD_TEMPLATE.substitute(title=title, text=text)
+        for title, text in cards
+    )
+    return f'<div class="recommendation-grid">{cards_html}</div>'
+
 # Function to generate product recommendations
 def generate_product_recommendations(customer_data, transactions_df):
     recommendations = []
@@ -671,6 +864,18 @@ def generate_special_offers(customer_data):
     
     return offers
 
+# Function to get cached product recommendations
+# Recommendations only depend on the primary category, and transactions_df comes
+# from the cached loader, so it is excluded from the cache key
+@st.cache_data(show_spinner=False)
+def get_cached_recommendations(primary_category, _transactions_df):
+    return generate_product_recommendations({'primary_category': primary_category}, _transactions_df)
+
+# Function to get cached special offers
+@st.cache_data(show_spinner=False)
+def get_cached_offers(segment_name):
+    return generate_special_offers({'segment_name': segment_name})
+
 # Main function
 def main():
     # Load CSS
@@ -681,7 +886,8 @@ def main():
     
     # Load data
     with st.spinner("Loading data..."):
-        transactions_df, customer_features = load_cached_data()
+        data_version = get_data_version()
+        transactions_df, customer_features = load_cached_data(data_version)
         
         # Create a proper city column from one-hot encoded city columns
         city_columns = [col for col in customer_features.columns if col.startswith('city_')]
@@ -710,7 +916,7 @@ def main():
     customer_segments = model.get_customer_segments(customer_features)
     
     # Combine customer features and segments
-    customer_data = customer_segments.copy()
+    customer_data = to_categorical(customer_segments.copy(), ['segment_name'])
     
     # Ensure city column is in customer_data
     if 'city' in customer_features.columns and 'city' not in customer_data.columns:
@@ -734,15 +940,15 @@ def main():
     st.sidebar.write(f"Total Customers: {len(customer_data)}")
     
     if filter_option == "Customer ID":
-        # Get list of customer IDs
-        customer_ids = customer_data.index.tolist()
+        # Get customer IDs (kept as an Index so only the displayed slice is converted to a list)
+        customer_ids = customer_data.index
         
         # Customer ID search
         search_id = st.sidebar.text_input("Search Customer ID")
         
         if search_id:
             # Filter customer IDs by search term
-            filtered_ids = [cid for cid in customer_ids if search_id.upper() in cid.upper()]
+            filtered_ids = customer_ids[customer_ids.str.upper().str.contains(search_id.upper(), regex=False)].tolist()
             
             if filtered_ids:
                 st.sidebar.write(f"Found {len(filtered_ids)} matching customers")
@@ -752,7 +958,7 @@ def main():
                 selected_customer_id = None
         else:
             # If no search term, show all customers
-            selected_customer_id = st.sidebar.selectbox("Select Customer", customer_ids[:100])  # Limit to first 100 for performance
+            selected_customer_id = st.sidebar.selectbox("Select Customer", customer_ids[:100].tolist())  # Limit to first 100 for performance
     
     elif filter_option == "Segment":
         # Get list of segments
@@ -774,7 +980,7 @@ def main():
         # Customer selection from filtered list
         selected_customer_id = st.sidebar.selectbox(
             f"Select {selected_segment} Customer",
-            segment_customers.index.tolist()[:100]  # Limit to first 100 for performance
+            segment_customers.index[:100].tolist()  # Limit to first 100 for performance
         )
     
     elif filter_option == "City":
@@ -786,7 +992,7 @@ def main():
                 st.sidebar.write(f"City column found: {customer_data['city'].name}")
                 
                 # Convert to string and handle NaN values
-                customer_data['city_clean'] = customer_data['city'].fillna('Unknown')
+                customer_data['city_clean'] = customer_data['city'].astype(object).fillna('Unknown')
                 customer_data['city_clean'] = customer_data['city_clean'].astype(str)
                 customer_data['city_clean'] = customer_data['city_clean'].str.strip()
                 
@@ -817,13 +1023,13 @@ def main():
                     if len(city_customers) > 0:
                         selected_customer_id = st.sidebar.selectbox(
                             f"Select Customer from {selected_city}",
-                            city_customers.index.tolist()[:100]  # Limit to first 100 for performance
+                            city_customers.index[:100].tolist()  # Limit to first 100 for performance
                         )
                     else:
                         st.sidebar.warning(f"No customers found in {selected_city}")
                         selected_customer_id = st.sidebar.selectbox(
                             "Select Customer",
-                            customer_data.index.tolist()[:100]  # Limit to first 100 for performance
+                            customer_data.index[:100].tolist()  # Limit to first 100 for performance
                         )
                 else:
                     st.sidebar.warning("No valid city information found in the dataset.")
@@ -832,47 +1038,51 @@ def main():
                     
                     selected_customer_id = st.sidebar.selectbox(
                         "Select Customer",
-                        customer_data.index.tolist()[:100]  # Limit to first 100 for performance
+                        customer_data.index[:100].tolist()  # Limit to first 100 for performance
                     )
             except Exception as e:
                 st.sidebar.error(f"Error processing city data: {e}")
                 st.sidebar.write("City data could not be processed. Using all customers instead.")
                 selected_customer_id = st.sidebar.selectbox(
                     "Select Customer",
-                    customer_data.index.tolist()[:100]  # Limit to first 100 for performance
+                    customer_data.index[:100].tolist()  # Limit to first 100 for performance
                 )
         else:
             st.sidebar.warning("City information not available in the dataset.")
             st.sidebar.write(f"Available columns: {customer_data.columns.tolist()}")
             selected_customer_id = st.sidebar.selectbox(
                 "Select Customer",
-                customer_data.index.tolist()[:100]  # Limit to first 100 for performance
+                customer_data.index[:100].tolist()  # Limit to first 100 for performance
             )
     
     else:  # All Customers
         # Customer selection from all customers
         selected_customer_id = st.sidebar.selectbox(
             "Select Customer",
-            customer_data.index.tolist()[:100]  # Limit to first 100 for performance
+            customer_data.index[:100].tolist()  # Limit to first 100 for performance
         )
     
     # Display customer profile if a customer is selected
     if selected_customer_id:
         # Get customer data
-        customer = customer_data.loc[selected_customer_id].to_dict()
+        customer = get_customer_records(data_version, customer_data)[selected_customer_id]
+        category_pct_columns = [col for col in customer_data.columns if col.startswith('pct_')]
         
-        # Get customer transactions
-        customer_transactions = transactions_df[transactions_df['customer_id'] == selected_customer_id].copy()
+        # Get customer transactions (no copy - columns that change are reassigned with .assign)
+        customer_transactions = transactions_df[transactions_df['customer_id'] == selected_customer_id]
         
         # Sort transactions by date (most recent first)
         if 'invoice_date' in customer_transactions.columns:
             try:
-                # Handle zero values
-                customer_transactions['invoice_date'] = customer_transactions['invoice_date'].replace(0, np.nan)
-                customer_transactions['invoice_date'] = customer_transactions['invoice_date'].replace('0', np.nan)
-                
-                # Try multiple date formats with error handling
-                customer_transactions['invoice_date'] = pd.to_datetime(customer_transactions['invoice_date'], errors='coerce')
+                # Handle zero values and parse dates with error handling
+                # (the loader normally provides datetime64 already, so this is usually skipped)
+                if not pd.api.types.is_datetime64_any_dtype(customer_transactions['invoice_date']):
+                    customer_transactions = customer_transactions.assign(
+                        invoice_date=pd.to_datetime(
+                            customer_transactions['invoice_date'].replace([0, '0'], np.nan),
+                            errors='coerce'
+                        )
+                    )
                 
                 # Remove rows with invalid dates for sorting
                 valid_dates = customer_transactions.dropna(subset=['invoice_date'])
@@ -888,173 +1098,84 @@ def main():
         else:
             first_name = "Customer"
         
-        # Create customer profile card
-        st.markdown('<div class="profile-card">', unsafe_allow_html=True)
-        
-        # Profile header
-        st.markdown('<div class="profile-header">', unsafe_allow_html=True)
-        st.markdown(generate_avatar(selected_customer_id, first_name), unsafe_allow_html=True)
-        st.markdown(f"""
-        <div>
-            <div class="profile-name">{first_name} <span class="profile-segment">{customer.get('segment_name', 'Unknown')}</span></div>
-            <div>{customer.get('email', 'No email available')}</div>
-        </div>
-        """, unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
+        # Profile header (avatar, name and segment) rendered in a single call.
+        # The HTML is kept unindented so markdown doesn't treat it as a code block.
+        st.markdown(
+            '<div class="profile-header">'
+            f'{generate_avatar(selected_customer_id, first_name).strip()}'
+            '<div>'
+            f'<div class="profile-name">{first_name} <span class="profile-segment">{customer.get("segment_name", "Unknown")}</span></div>'
+            f'<div>{customer.get("email", "No email available")}</div>'
+            '</div>'
+            '</div>',
+            unsafe_allow_html=True
+        )
         
         # Profile information
         col1, col2 = st.columns(2)
         
         with col1:
-            st.markdown('<div class="profile-info">', unsafe_allow_html=True)
-            
-            # Customer ID
-            st.markdown(f"""
-            <div class="profile-info-item">
-                <div class="profile-info-label">Customer ID:</div>
-                <div class="profile-info-value">{selected_customer_id}</div>
-            </div>
-            """, unsafe_allow_html=True)
+            info_items = [('Customer ID', selected_customer_id)]
             
             # Gender
             if 'gender' in customer:
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">Gender:</div>
-                    <div class="profile-info-value">{customer['gender']}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('Gender', customer['gender']))
             
             # Age
             if 'age' in customer:
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">Age:</div>
-                    <div class="profile-info-value">{customer['age']}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('Age', customer['age']))
             
             # City
             if 'city' in customer:
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">City:</div>
-                    <div class="profile-info-value">{customer['city']}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('City', customer['city']))
             
-            st.markdown('</div>', unsafe_allow_html=True)
+            st.markdown(render_profile_info(info_items), unsafe_allow_html=True)
         
         with col2:
-            st.markdown('<div class="profile-info">', unsafe_allow_html=True)
+            info_items = []
             
             # First purchase date
             if 'first_purchase_date' in customer:
-                try:
-                    # Handle invalid date values
-                    if pd.notna(customer['first_purchase_date']) and customer['first_purchase_date'] != 0 and customer['first_purchase_date'] != '0':
-                        first_purchase = pd.to_datetime(customer['first_purchase_date'], errors='coerce')
-                        if pd.notna(first_purchase):
-                            first_purchase = first_purchase.strftime('%B %d, %Y')
-                        else:
-                            first_purchase = "Not available"
-                    else:
-                        first_purchase = "Not available"
-                except:
-                    first_purchase = "Not available"
-                
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">First Purchase:</div>
-                    <div class="profile-info-value">{first_purchase}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('First Purchase', format_purchase_date(customer['first_purchase_date'])))
             
             # Last purchase date
             if 'last_purchase_date' in customer:
-                try:
-                    # Handle invalid date values
-                    if pd.notna(customer['last_purchase_date']) and customer['last_purchase_date'] != 0 and customer['last_purchase_date'] != '0':
-                        last_purchase = pd.to_datetime(customer['last_purchase_date'], errors='coerce')
-                        if pd.notna(last_purchase):
-                            last_purchase = last_purchase.strftime('%B %d, %Y')
-                        else:
-                            last_purchase = "Not available"
-                    else:
-                        last_purchase = "Not available"
-                except:
-                    last_purchase = "Not available"
-                
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">Last Purchase:</div>
-                    <div class="profile-info-value">{last_purchase}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('Last Purchase', format_purchase_date(customer['last_purchase_date'])))
             
             # Days since last purchase
             if 'recency' in customer:
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">Days Since Purchase:</div>
-                    <div class="profile-info-value">{int(customer['recency'])}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('Days Since Purchase', int(customer['recency'])))
             
             # Primary category
             if 'primary_category' in customer:
-                st.markdown(f"""
-                <div class="profile-info-item">
-                    <div class="profile-info-label">Primary Category:</div>
-                    <div class="profile-info-value">{customer['primary_category']}</div>
-                </div>
-                """, unsafe_allow_html=True)
+                info_items.append(('Primary Category', customer['primary_category']))
             
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+            st.markdown(render_profile_info(info_items), unsafe_allow_html=True)
         
         # Customer metrics
         st.markdown('<h2 class="sub-header">Customer Metrics</h2>', unsafe_allow_html=True)
         
-        metric_col1, metric_col2, metric_col3, metric_col4 = st.columns(4)
-        
-        with metric_col1:
-            st.markdown(f"""
-            <div class="metric-card">
-                <div class="metric-value">{customer.get('transaction_count', 0):.0f}</div>
-                <div class="metric-label">Total Transactions</div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with metric_col2:
-            st.markdown(f"""
-            <div class="metric-card">
-                <div class="metric-value">₹{customer.get('total_spend', 0):.2f}</div>
-                <div class="metric-label">Total Spend</div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with metric_col3:
-            st.markdown(f"""
-            <div class="metric-card">
-                <div class="metric-value">₹{customer.get('average_transaction_value', 0):.2f}</div>
-                <div class="metric-label">Avg. Transaction Value</div>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with metric_col4:
-            st.markdown(f"""
-            <div class="metric-card">
-                <div class="metric-value">{customer.get('purchase_frequency', 0):.2f}</div>
-                <div class="metric-label">Purchases per Month</div>
-            </div>
-            """, unsafe_allow_html=True)
+        metric_cards = "".join(
+            METRIC_CARD_TEMPLATE.substitute(value=value, label=label)
+            for value, label in [
+                (f"{customer.get('transaction_count', 0):.0f}", "Total Transactions"),
+                (f"₹{customer.get('total_spend', 0):.2f}", "Total Spend"),
+                (f"₹{customer.get('average_transaction_value', 0):.2f}", "Avg. Transaction Value"),
+                (f"{customer.get('purchase_frequency', 0):.2f}", "Purchases per Month")
+            ]
+        )
+        st.markdown(f'<div class="metrics-container">{metric_cards}</div>', unsafe_allow_html=True)
         
-        # Create tabs for different sections
-        tab1, tab2, tab3, tab4 = st.tabs(["Purchase History", "Category Preferences", "Recommendations", "Geographic Distribution"])
+        # Section selector - only the active section is rendered on each rerun,
+        # unlike st.tabs which executes every tab body
+        active_section = st.radio(
+            "Section",
+            ["Purchase History", "Category Preferences", "Recommendations", "Geographic Distribution"],
+            horizontal=True,
+            key="profile_section"
+        )
         
-        with tab1:
+        if active_section == "Purchase History":
             st.markdown('<div class="tab-section-header"><h3>Purchase History</h3></div>', unsafe_allow_html=True)
             
             if len(customer_transactions) > 0:
@@ -1062,70 +1183,52 @@ def main():
                 display_cols = ['invoice_no', 'invoice_date', 'product_name', 'category', 'quantity', 'price', 'total_amount', 'payment_method', 'shopping_mall']
                 display_cols = [col for col in display_cols if col in customer_transactions.columns]
                 
-                # Format date column
-                if 'invoice_date' in display_cols:
-                    customer_transactions['invoice_date'] = customer_transactions['invoice_date'].dt.strftime('%Y-%m-%d')
-                
-                # Format numeric columns
-                for col in ['price', 'total_amount']:
-                    if col in display_cols:
-                        customer_transactions[col] = customer_transactions[col].map('₹{:.2f}'.format)
+                # Format columns on the frontend so values stay numeric/datetime64 in the Arrow table
+                column_config = {
+                    'price': st.column_config.NumberColumn(format='₹%.2f'),
+                    'total_amount': st.column_config.NumberColumn(format='₹%.2f')
+                }
+                if 'invoice_date' in display_cols and pd.api.types.is_datetime64_any_dtype(customer_transactions['invoice_date']):
+                    column_config['invoice_date'] = st.column_config.DatetimeColumn(format='YYYY-MM-DD')
                 
                 # Display transactions
-                st.dataframe(customer_transactions[display_cols], use_container_width=True)
+                st.dataframe(
+                    customer_transactions[display_cols],
+                    use_container_width=True,
+                    column_config=column_config
+                )
                 
                 # Transaction trends over time
                 if 'invoice_date' in customer_transactions.columns and len(customer_transactions) > 1:
                     st.markdown('<div class="tab-section-header"><h3>Spending Trends</h3></div>', unsafe_allow_html=True)
                     
-                    # Special handling for spending trends
-                    monthly_spent_df = customer_transactions.copy()
-                    
-                    # Make sure invoice_date is datetime
-                    if 'invoice_date' in monthly_spent_df.columns:
+                    # invoice_date was already parsed to datetime64 above, so no re-parsing is needed
+                    if pd.api.types.is_datetime64_any_dtype(customer_transactions['invoice_date']):
                         try:
-                            monthly_spent_df['invoice_date'] = pd.to_datetime(monthly_spent_df['invoice_date'], errors='coerce')
-                            
                             # Drop rows with invalid dates
-                            monthly_spent_df = monthly_spent_df.dropna(subset=['invoice_date'])
-                            
-                            # Extract month and year
-                            monthly_spent_df['month_year'] = monthly_spent_df['invoice_date'].dt.strftime('%Y-%m')
-                            
-                            # Group by month and calculate total spending
-                            monthly_spend = monthly_spent_df.groupby('month_year')['total_amount'].sum().reset_index()
-                            
-                            # Sort by date
-                            monthly_spend['invoice_date'] = pd.to_datetime(monthly_spend['month_year'], format='%Y-%m')
-                            monthly_spend = monthly_spend.sort_values('invoice_date')
-                            
-                            # Create line chart for spending trends
-                            fig = px.line(
-                                monthly_spend,
-                                x='invoice_date',
-                                y='total_amount',
-                                title='Monthly Spending Trends',
-                                labels={'invoice_date': 'Month', 'total_amount': 'Total Spend (₹)'},
-                                markers=True
-                            )
+                            monthly_spent_df = customer_transactions.dropna(subset=['invoice_date'])
                             
-                            fig.update_layout(
-                                xaxis_title='Month',
-                                yaxis_title='Total Spend (₹)',
-                                xaxis=dict(tickangle=45),
-                                legend=dict(bgcolor='rgba(0,0,0,0)')  # Add transparent legend background
+                            # Resample to month-start bins and calculate total spending
+                            # (stays in datetime64, output is sorted by month)
+                            monthly_spend = (
+                                monthly_spent_df.set_index('invoice_date')['total_amount']
+                                .resample('MS')
+                                .sum()
+                                .reset_index()
                             )
                             
+                            # Create line chart for spending trends
+                            fig = build_monthly_spending_chart(selected_customer_id, data_version, monthly_spend)
                             st.plotly_chart(fig, use_container_width=True, key="monthly_spending_trends")
                         except Exception as e:
                             st.error(f"Error processing date data for trends: {e}")
                             st.info("Unable to create spending trends chart due to data issues.")
                     else:
-                        st.info("Cannot create spending trends chart: no invoice date column found.")
+                        st.info("Cannot create spending trends chart: invoice dates could not be parsed.")
             else:
                 st.info("No transaction history available for this customer.")
         
-        with tab2:
+        if active_section == "Category Preferences":
             st.markdown('<div class="tab-section-header"><h3>Category Preferences</h3></div>', unsafe_allow_html=True)
             
             if len(customer_transactions) > 0 and 'category' in customer_transactions.columns:
@@ -1133,60 +1236,37 @@ def main():
                 st.info("Showing category preferences based on actual transaction history")
                 
                 try:
-                    # Find the column that might contain transaction amounts
-                    amount_columns = [col for col in customer_transactions.columns if 'amount' in col.lower() or 'price' in col.lower() or 'value' in col.lower()]
-                    
+                    # total_amount is cleaned to float64 by the data loader, so it can be summed directly
                     if 'total_amount' in customer_transactions.columns:
-                        amount_column = 'total_amount'
-                    elif amount_columns:
-                        amount_column = amount_columns[0]
-                    else:
-                        amount_column = None
-                    
-                    # Convert to numeric if needed
-                    if amount_column:
-                        # Try to convert to numeric
-                        customer_transactions[amount_column] = pd.to_numeric(customer_transactions[amount_column], errors='coerce')
-                        
-                        # If conversion fails, create a fallback column
-                        if customer_transactions[amount_column].isna().all():
-                            # Create dummy values - assign different values to different categories
-                            customer_transactions['dummy_amount'] = 1.0
-                            categories = customer_transactions['category'].unique()
-                            for i, cat in enumerate(categories):
-                                # Assign different values to each category for visual differentiation
-                                customer_transactions.loc[customer_transactions['category'] == cat, 'dummy_amount'] = (i + 1) * 10.0
-                            amount_column = 'dummy_amount'
-                    
-                    # Create a very simple dataframe for visualization
-                    if amount_column:
-                        category_data = customer_transactions.groupby('category')[amount_column].sum().reset_index()
+                        category_data = customer_transactions.groupby('category', observed=True)['total_amount'].sum().reset_index()
                         category_data.columns = ['Category', 'Total Spend']
                     else:
                         # Fallback to count if amount isn't available
-                        category_data = customer_transactions.groupby('category').size().reset_index()
+                        category_data = customer_transactions.groupby('category', observed=True).size().reset_index()
                         category_data.columns = ['Category', 'Count']
                         category_data['Total Spend'] = category_data['Count']  # Use count as proxy for spending
                     
-                    # Make sure no NaN values
-                    category_data = category_data.fillna(0)
+                    # Make sure no NaN values (only the numeric column; Category is categorical)
+                    category_data['Total Spend'] = category_data['Total Spend'].fillna(0)
                     
                     # If all spending is zero, create dummy values for visualization
                     if (category_data['Total Spend'] == 0).all():
-                        # Create dummy values for each category
-                        for i in range(len(category_data)):
-                            category_data.loc[i, 'Total Spend'] = (i + 1) * 10.0
+                        category_data['Total Spend'] = np.arange(1, len(category_data) + 1) * 10.0
+                    
+                    # Add share of spend and order the table by spend
+                    category_data['Percentage'] = category_data['Total Spend'] / category_data['Total Spend'].sum() * 100
+                    category_data = category_data.sort_values('Total Spend', ascending=False, ignore_index=True)
                     
                     # Create simple pie chart
                     if not category_data.empty:
                         try:
-                            fig = px.pie(
-                                category_data, 
-                                values='Total Spend', 
-                                names='Category',
-                                title='Category Spending Distribution'
+                            fig = build_category_pie_chart(
+                                selected_customer_id,
+                                data_version,
+                                category_data,
+                                'Total Spend',
+                                'Category Spending Distribution'
                             )
-                            fig.update_layout(legend=dict(bgcolor='rgba(0,0,0,0)'))
                             st.plotly_chart(fig, use_container_width=True)
                         except Exception as e1:
                             # Try with go.Figure as alternative
@@ -1224,34 +1304,29 @@ def main():
                     st.error("Error processing category data")
             
             # Fallback to pre-calculated values if no transaction data
-            elif [col for col in customer.keys() if col.startswith('pct_')]:
+            elif category_pct_columns:
                 st.info("Showing pre-calculated category preferences (may not match transaction history)")
                 # Get category preference columns
-                category_cols = [col for col in customer.keys() if col.startswith('pct_')]
+                category_cols = category_pct_columns
                 
                 # Create simple DataFrame for visualization
                 try:
-                    pre_calc_data = []
-                    for col in category_cols:
-                        category_name = col.replace('pct_', '').title()
-                        percentage = customer.get(col, 0)
-                        pre_calc_data.append({
-                            'Category': category_name,
-                            'Percentage': percentage
-                        })
-                    
-                    pre_calc_df = pd.DataFrame(pre_calc_data)
+                    pre_calc = pd.Series({col: customer.get(col, 0) for col in category_cols}, dtype=float)
+                    pre_calc_df = pd.DataFrame({
+                        'Category': pre_calc.index.str.replace('pct_', '').str.title(),
+                        'Percentage': pre_calc.values
+                    }).sort_values('Percentage', ascending=False, ignore_index=True)
                     
                     # Create simple pie chart
                     if not pre_calc_df.empty:
                         try:
-                            fig = px.pie(
+                            fig = build_category_pie_chart(
+                                selected_customer_id,
+                                data_version,
                                 pre_calc_df,
-                                values='Percentage',
-                                names='Category',
-                                title='Category Spending Distribution (Pre-calculated)'
+                                'Percentage',
+                                'Category Spending Distribution (Pre-calculated)'
                             )
-                            fig.update_layout(legend=dict(bgcolor='rgba(0,0,0,0)'))
                             st.plotly_chart(fig, use_container_width=True)
                         except Exception:
                             # Fallback to bar chart
@@ -1285,102 +1360,43 @@ def main():
                 top_products = customer_transactions['product_name'].value_counts().head(5)
                 
                 # Create bar chart
-                fig = px.bar(
-                    x=top_products.index,
-                    y=top_products.values,
-                    title='Top Purchased Products',
-                    labels={'x': 'Product', 'y': 'Purchase Count'}
-                )
-                
-                # Add transparent legend background
-                fig.update_layout(
-                    legend=dict(bgcolor='rgba(0,0,0,0)')
-                )
+                fig = build_top_products_chart(selected_customer_id, data_version, top_products)
                 
                 st.plotly_chart(fig, use_container_width=True, key="top_products_chart")
         
-        with tab3:
+        if active_section == "Recommendations":
             # Product recommendations
             st.markdown('<div class="tab-section-header"><h3>Recommended Products</h3></div>', unsafe_allow_html=True)
             
-            recommendations = generate_product_recommendations(customer, transactions_df)
+            recommendations = get_cached_recommendations(customer.get('primary_category', ''), transactions_df)
             
-            rec_col1, rec_col2, rec_col3 = st.columns(3)
-            
-            for i, (col, rec) in enumerate(zip([rec_col1, rec_col2, rec_col3], recommendations)):
-                with col:
-                    st.markdown(f"""
-                    <div class="recommendation-card">
-                        <div class="recommendation-title">{rec['title']}</div>
-                        <div class="recommendation-text">{rec['reason']}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
+            st.markdown(
+                render_recommendation_cards((rec['title'], rec['reason']) for rec in recommendations[:3]),
+                unsafe_allow_html=True
+            )
             
             # Special offers
             st.markdown('<div class="tab-section-header"><h3>Special Offers</h3></div>', unsafe_allow_html=True)
             
-            offers = generate_special_offers(customer)
-            
-            offer_col1, offer_col2 = st.columns(2)
+            offers = get_cached_offers(customer.get('segment_name', ''))
             
-            for i, (col, offer) in enumerate(zip([offer_col1, offer_col2], offers)):
-                with col:
-                    st.markdown(f"""
-                    <div class="recommendation-card">
-                        <div class="recommendation-title">{offer['title']}</div>
-                        <div class="recommendation-text">{offer['text']}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
+            st.markdown(
+                render_recommendation_cards((offer['title'], offer['text']) for offer in offers[:2]),
+                unsafe_allow_html=True
+            )
         
-        with tab4:
+        if active_section == "Geographic Distribution":
             st.markdown('<div class="tab-section-header"><h3>Customer Geographic Distribution</h3></div>', unsafe_allow_html=True)
             
-            # Create a DataFrame for mapping customer locations
-            mapping_data = pd.DataFrame(index=customer_data.index)
-            
-            # Add segment information for coloring
-            if 'segment_name' in customer_data.columns:
-                mapping_data['segment_name'] = customer_data['segment_name'].values
-            else:
-                # If we have a selected customer, use their segment
-                segment = customer.get('segment_name', '')
-                mapping_data['segment_name'] = segment if segment else 'Unknown'
-            
-            # Clean and prepare city data for mapping
-            mapping_data['city'] = 'Unknown'  # Set default value
-            
-            # Extract city from location if it exists
-            if 'location' in customer_data.columns and pd.notna(customer_data['location']).any():
-                for idx, row in customer_data.iterrows():
-                    if pd.notna(row.get('location')):
-                        city = str(row['location']).split(',')[0].strip()
-                        if city and city != 'Unknown':
-                            mapping_data.at[idx, 'city'] = city
-            
-            # Handle one-hot encoded city columns
-            elif any(col.startswith('city_') for col in customer_data.columns):
-                city_columns = [col for col in customer_data.columns if col.startswith('city_')]
-                
-                for idx, row in customer_data.iterrows():
-                    for city_col in city_columns:
-                        if pd.notna(row.get(city_col)) and row.get(city_col) == 1:
-                            city_name = city_col.replace('city_', '')
-                            mapping_data.at[idx, 'city'] = city_name
-            
-            # Use direct city column if available
-            elif 'city' in customer_data.columns:
-                for idx, row in customer_data.iterrows():
-                    if pd.notna(row.get('city')):
-                        mapping_data.at[idx, 'city'] = row['city']
-            
-            # Create the map using the prepared data
-            fig = create_customer_location_map(mapping_data)
+            # Build the mapping data and the all-customers map (cached across reruns)
+            mapping_data = build_mapping_data(customer_data)
+            fig = build_all_customers_map(mapping_data)
             st.plotly_chart(fig, use_container_width=True, key="all_customers_map")
             
             # Display map of customers in the same segment
             if 'segment_name' in customer and customer.get('segment_name'):
                 segment_name = customer.get('segment_name', 'Unknown')
-                segment_customers = mapping_data.copy()
+                segment_customers = mapping_data
                 
                 # Filter for customers in the same segment, if we have multiple customers
                 if len(mapping_data) > 1 and 'segment_name' in mapping_data.columns:
@@ -1390,7 +1406,7 @@ def main():
                 if len(segment_customers) > 0:
                     segment_title = f"{segment_name} Customers by Location"
                     st.markdown(f'<div class="tab-section-header"><h3>{segment_title}</h3></div>', unsafe_allow_html=True)
-                    fig = create_customer_location_map(segment_customers)
+                    fig = build_segment_map(mapping_data, segment_name)
                     st.plotly_chart(fig, use_container_width=True, key="segment_customers_map")
     
     else:
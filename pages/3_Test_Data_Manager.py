@@ -6,9 +6,9 @@ This page allows users to add and manage test customer data for email marketing
 import os
 import streamlit as st
 import pandas as pd
-import uuid
-from datetime import datetime, timedelta
-import random
+import numpy as np
+import secrets
+from datetime import datetime
 
 # Set page configuration
 st.set_page_config(
@@ -26,8 +26,11 @@ if 'edit_index' not in st.session_state:
     st.session_state.edit_index = None
 if 'edited_data' not in st.session_state:
     st.session_state.edited_data = None
+if 'pending_rows' not in st.session_state:
+    st.session_state.pending_rows = []
 
-# Custom CSS
+# Custom CSS (Streamlit drops elements that aren't re-emitted, so this is written on
+# every rerun; keep it limited to classes the page actually uses)
 def load_css():
     st.markdown("""
     <style>
@@ -42,112 +45,224 @@ def load_css():
             color: #5E35B1;
             margin-bottom: 1.5rem;
         }
-        .action-btn {
-            background-color: #4527A0;
-            color: white;
-            padding: 0.5rem 1rem;
-            border-radius: 0.3rem;
-            text-decoration: none;
-            font-weight: bold;
-        }
-        .email-edit-table {
-            width: 100%;
-            border-collapse: collapse;
-        }
-        .email-edit-table th, .email-edit-table td {
-            padding: 8px;
-            text-align: left;
-            border-bottom: 1px solid #ddd;
-        }
-        .email-edit-table tr:hover {
-            background-color: #f5f5f5;
-        }
     </style>
     """, unsafe_allow_html=True)
 
 # Constants
+# Kept as CSV: the Test Email Campaign page reads the same file and new customers are
+# appended in batches. Reads are cached by mtime with explicit dtypes, so the file is
+# only parsed again after it changes.
 TEST_DATA_PATH = "data/test_customers.csv"
 DEFAULT_SEGMENTS = ["VIP", "Regular", "New", "Occasional", "At Risk"]
 DEFAULT_CATEGORIES = ["electronics", "clothing", "home_kitchen", "groceries"]
+GENDER_OPTIONS = ["Male", "Female", "Other"]
+
+# Low-cardinality columns stored as categoricals, with the values the forms can assign
+CATEGORICAL_COLUMNS = {
+    'segment_name': DEFAULT_SEGMENTS,
+    'primary_category': DEFAULT_CATEGORIES,
+    'gender': GENDER_OPTIONS
+}
+TEST_DATA_COLUMNS = [
+    'customer_id', 'email', 'first_name', 'last_name',
+    'segment_name', 'primary_category', 'age', 'gender', 'city',
+    'last_purchase_date', 'total_spent'
+]
+TEST_DATA_DTYPES = {
+    'customer_id': str,  # IDs such as "00123456" or "1234e567" must not be parsed as numbers
+    'email': str,
+    'first_name': str,
+    'last_name': str,
+    'segment_name': str,
+    'primary_category': str,
+    'age': 'Int16',
+    'gender': str,
+    'city': str,
+    'last_purchase_date': str,
+    'total_spent': 'float64'
+}
+SEARCH_COLUMN = "_search"  # Lowercased email/name text used by the search box, never saved
+WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB buffer for CSV writes
+PENDING_ROWS_FLUSH_SIZE = 10  # Added customers are appended to the file in batches of this size
+
+# Value pools for random test data
+RANDOM_FIRST_NAMES = ["John", "Mary", "James", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth"]
+RANDOM_LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez"]
+RANDOM_EMAIL_DOMAINS = ["gmail.com", "yahoo.com", "hotmail.com", "outlook.com"]
+RANDOM_CITIES = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix", "Philadelphia", "San Antonio", "San Diego", "Dallas", "San Jose"]
+
+# Function to add the precomputed search column
+def add_search_column(df):
+    """Add a single lowercased email/first name/last name column for searching"""
+    df[SEARCH_COLUMN] = (
+        df['email'].fillna('').astype(str) + '|' +
+        df['first_name'].fillna('').astype(str) + '|' +
+        df['last_name'].fillna('').astype(str)
+    ).str.lower()
+    return df
+
+# Function to convert low-cardinality columns to categoricals
+def to_categorical(df):
+    """Store segment, category and gender as categoricals that include every form option"""
+    for col, options in CATEGORICAL_COLUMNS.items():
+        if col in df.columns:
+            categories = sorted(set(options) | set(df[col].dropna()))
+            df[col] = df[col].astype(pd.CategoricalDtype(categories))
+    return df
+
+# Function to get the sorted options for a filter multiselect
+def get_filter_options(test_data, col, default_options):
+    """Use the categorical's (already sorted) categories instead of sorting unique values"""
+    if isinstance(test_data[col].dtype, pd.CategoricalDtype):
+        options = test_data[col].cat.categories.tolist()
+    else:
+        options = sorted(test_data[col].dropna().unique())
+    return options or default_options
+
+# Function to read the test data file (cached until the file changes)
+@st.cache_data(show_spinner=False)
+def load_test_data_file(path, mtime):
+    """Parse the test customer CSV; mtime is only part of the cache key"""
+    # The C parser applies the dtypes while parsing, so IDs keep their exact text and blank fields stay NaN
+    return add_search_column(to_categorical(pd.read_csv(path, dtype=TEST_DATA_DTYPES)))
 
 # Function to load test data
 def load_test_data():
     """Load test customer data from CSV file"""
     try:
         if os.path.exists(TEST_DATA_PATH):
-            return pd.read_csv(TEST_DATA_PATH)
+            return load_test_data_file(TEST_DATA_PATH, os.path.getmtime(TEST_DATA_PATH))
         else:
             # Create empty dataframe with required columns
-            return pd.DataFrame(columns=[
-                'customer_id', 'email', 'first_name', 'last_name', 
-                'segment_name', 'primary_category', 'age', 'gender', 'city',
-                'last_purchase_date', 'total_spent'
-            ])
+            return pd.DataFrame(columns=TEST_DATA_COLUMNS)
     except Exception as e:
         st.error(f"Error loading test data: {e}")
         return pd.DataFrame()
 
+# Function to read the raw test data file for export (cached until the file changes)
+@st.cache_data(max_entries=1, show_spinner=False)
+def load_test_data_bytes(path, mtime):
+    """Read the test customer CSV as bytes; mtime is only part of the cache key"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+# Function to build the CSV export of the test data
+def get_export_csv():
+    """Return the saved test data file plus any pending customers as CSV bytes"""
+    csv_bytes = b""
+    write_header = True
+    
+    if os.path.exists(TEST_DATA_PATH):
+        csv_bytes = load_test_data_bytes(TEST_DATA_PATH, os.path.getmtime(TEST_DATA_PATH))
+        write_header = False
+    
+    if st.session_state.pending_rows:
+        pending_csv = get_pending_rows_frame().to_csv(header=write_header, index=False)
+        csv_bytes += pending_csv.encode('utf-8')
+    
+    return csv_bytes
+
 # Function to save test data
 def save_test_data(df):
     """Save test customer data to CSV file"""
     try:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(TEST_DATA_PATH), exist_ok=True)
-        df.to_csv(TEST_DATA_PATH, index=False)
+        with open(TEST_DATA_PATH, 'w', buffering=WRITE_BUFFER_SIZE, newline='') as f:
+            df.drop(columns=SEARCH_COLUMN, errors='ignore').to_csv(f, index=False)
+        load_test_data_file.clear()
+        load_test_data_bytes.clear()
+        # The saved dataframe already includes any pending rows
+        st.session_state.pending_rows = []
         return True
     except Exception as e:
         st.error(f"Error saving test data: {e}")
         return False
 
+# Function to build a dataframe from the pending customer tuples
+def get_pending_rows_frame():
+    """Pending rows are stored as tuples in TEST_DATA_COLUMNS order"""
+    return pd.DataFrame.from_records(st.session_state.pending_rows, columns=TEST_DATA_COLUMNS)
+
+# Function to append customers to the test data file
+def append_test_data(df):
+    """Append rows to the CSV file without rewriting the existing data"""
+    try:
+        os.makedirs(os.path.dirname(TEST_DATA_PATH), exist_ok=True)
+        write_header = not os.path.exists(TEST_DATA_PATH)
+        with open(TEST_DATA_PATH, 'a', buffering=WRITE_BUFFER_SIZE, newline='') as f:
+            df.reindex(columns=TEST_DATA_COLUMNS).to_csv(f, header=write_header, index=False)
+        load_test_data_file.clear()
+        load_test_data_bytes.clear()
+        return True
+    except Exception as e:
+        st.error(f"Error saving test data: {e}")
+        return False
+
+# Function to append pending customers to the test data file
+def flush_pending_rows():
+    """Append buffered new customers to the CSV file in a single write"""
+    if not st.session_state.pending_rows:
+        return True
+    
+    if append_test_data(get_pending_rows_frame()):
+        st.session_state.pending_rows = []
+        return True
+    return False
+
+# Function to combine saved test data with pending customers
+def merge_pending_rows(test_data):
+    """Return test data including customers that have not been flushed yet"""
+    if not st.session_state.pending_rows:
+        return test_data
+    pending_data = get_pending_rows_frame()
+    
+    # Match the loaded dtypes so the concat keeps categorical columns
+    pending_data = pending_data.astype({
+        col: dtype for col, dtype in test_data.dtypes.items() if col in pending_data.columns
+    })
+    return pd.concat([test_data, add_search_column(pending_data)], ignore_index=True)
+
 # Function to generate random customer data
 def generate_random_data(num_customers=5):
     """Generate random customer data for testing"""
-    random_data = []
-    cities = ["New York", "Los Angeles", "Chicago", "Houston", "Phoenix", "Philadelphia", "San Antonio", "San Diego", "Dallas", "San Jose"]
+    rng = np.random.default_rng()
     
-    for _ in range(num_customers):
-        customer_id = str(uuid.uuid4())[:8]
-        email_domain = random.choice(["gmail.com", "yahoo.com", "hotmail.com", "outlook.com"])
-        first_name = random.choice(["John", "Mary", "James", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth"])
-        last_name = random.choice(["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez"])
-        email = f"{first_name.lower()}.{last_name.lower()}@{email_domain}"
-        
-        segment_name = random.choice(DEFAULT_SEGMENTS)
-        primary_category = random.choice(DEFAULT_CATEGORIES)
-        age = random.randint(18, 65)
-        gender = random.choice(["Male", "Female"])
-        city = random.choice(cities)
-        
-        # Random last purchase date within last 60 days
-        days_ago = random.randint(1, 60)
-        last_purchase_date = (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
-        
-        total_spent = round(random.uniform(50.0, 1000.0), 2)
-        
-        random_data.append({
-            'customer_id': customer_id,
-            'email': email,
-            'first_name': first_name,
-            'last_name': last_name,
-            'segment_name': segment_name,
-            'primary_category': primary_category,
-            'age': age,
-            'gender': gender,
-            'city': city,
-            'last_purchase_date': last_purchase_date,
-            'total_spent': total_spent
-        })
+    first_names = rng.choice(RANDOM_FIRST_NAMES, size=num_customers)
+    last_names = rng.choice(RANDOM_LAST_NAMES, size=num_customers)
+    email_domains = rng.choice(RANDOM_EMAIL_DOMAINS, size=num_customers)
+    emails = (
+        pd.Series(first_names).str.lower() + "." +
+        pd.Series(last_names).str.lower() + "@" +
+        pd.Series(email_domains)
+    )
+    
+    # Random last purchase date within last 60 days
+    days_ago = rng.integers(1, 61, size=num_customers)
+    last_purchase_dates = (pd.Timestamp.now().normalize() - pd.to_timedelta(days_ago, unit='D')).strftime("%Y-%m-%d")
     
-    return pd.DataFrame(random_data)
+    return pd.DataFrame({
+        'customer_id': [secrets.token_hex(4) for _ in range(num_customers)],
+        'email': emails,
+        'first_name': first_names,
+        'last_name': last_names,
+        'segment_name': rng.choice(DEFAULT_SEGMENTS, size=num_customers),
+        'primary_category': rng.choice(DEFAULT_CATEGORIES, size=num_customers),
+        'age': rng.integers(18, 66, size=num_customers),
+        'gender': rng.choice(["Male", "Female"], size=num_customers),
+        'city': rng.choice(RANDOM_CITIES, size=num_customers),
+        'last_purchase_date': last_purchase_dates,
+        'total_spent': np.round(rng.uniform(50.0, 1000.0, size=num_customers), 2)
+    })
 
 # Function to edit customer data
 def edit_customer(test_data, index, new_data):
     """Edit customer data at the given index"""
     try:
-        updated_data = test_data.copy()
-        for key, value in new_data.items():
-            updated_data.at[index, key] = value
-        return updated_data
+        # test_data is this rerun's own copy (st.cache_data returns a fresh one), so
+        # the row can be updated in place with a single assignment
+        test_data.loc[index, list(new_data)] = list(new_data.values())
+        return test_data
     except Exception as e:
         st.error(f"Error updating customer data: {e}")
         return test_data
@@ -171,9 +286,6 @@ def main():
     # Display header
     st.markdown('<h1 class="main-header">Test Data Manager</h1>', unsafe_allow_html=True)
     
-    # Load test data
-    test_data = load_test_data()
-    
     # Create tabs
     tab1, tab2, tab3 = st.tabs(["Add Test Customers", "View/Edit Test Data", "Generate Random Data"])
     
@@ -193,7 +305,7 @@ def main():
             with col2:
                 segment = st.selectbox("Customer Segment", DEFAULT_SEGMENTS)
                 category = st.selectbox("Primary Product Category", DEFAULT_CATEGORIES)
-                gender = st.selectbox("Gender", ["Male", "Female", "Other"])
+                gender = st.selectbox("Gender", GENDER_OPTIONS)
             
             # Additional information
             col3, col4 = st.columns(2)
@@ -217,7 +329,7 @@ def main():
                 st.error("First name is required.")
             else:
                 # Create customer ID
-                customer_id = str(uuid.uuid4())[:8]
+                customer_id = secrets.token_hex(4)
                 
                 # Create new customer record
                 new_customer = {
@@ -234,16 +346,29 @@ def main():
                     'total_spent': total_spent
                 }
                 
-                # Add new customer to dataframe
-                test_data = pd.concat([test_data, pd.DataFrame([new_customer])], ignore_index=True)
+                # Buffer the new customer and append to the file once enough are pending
+                st.session_state.pending_rows.append(tuple(new_customer[col] for col in TEST_DATA_COLUMNS))
                 
-                # Save updated data
-                if save_test_data(test_data):
+                if len(st.session_state.pending_rows) >= PENDING_ROWS_FLUSH_SIZE:
+                    if flush_pending_rows():
+                        st.success(f"Customer {first_name} {last_name} added and saved successfully!")
+                else:
                     st.success(f"Customer {first_name} {last_name} added successfully!")
+        
+        # Save any customers that are still buffered
+        if st.session_state.pending_rows:
+            st.info(f"{len(st.session_state.pending_rows)} added customer(s) not yet saved to file.")
+            if st.button("Save Pending Customers"):
+                if flush_pending_rows():
+                    st.success("Pending customers saved successfully!")
     
     with tab2:
         st.markdown('<h2 class="sub-header">Test Customer Data</h2>', unsafe_allow_html=True)
         
+        # Include customers added in this session (reloading is a cache hit unless a flush just
+        # changed the file) and those that are still buffered
+        test_data = merge_pending_rows(load_test_data())
+        
         if test_data.empty:
             st.info("No test customers found. Add some customers in the 'Add Test Customers' tab.")
         else:
@@ -256,26 +381,24 @@ def main():
             filter_col1, filter_col2 = st.columns(2)
             
             with filter_col1:
-                filter_segment = st.multiselect("Filter by Segment", options=sorted(test_data['segment_name'].unique()))
+                filter_segment = st.multiselect("Filter by Segment", options=get_filter_options(test_data, 'segment_name', DEFAULT_SEGMENTS))
             
             with filter_col2:
-                filter_category = st.multiselect("Filter by Category", options=sorted(test_data['primary_category'].unique()))
+                filter_category = st.multiselect("Filter by Category", options=get_filter_options(test_data, 'primary_category', DEFAULT_CATEGORIES))
             
-            # Apply filters
-            filtered_data = test_data.copy()
+            # Apply filters as one combined mask and index the data once
+            mask = np.ones(len(test_data), dtype=bool)
             
             if search_term:
-                filtered_data = filtered_data[
-                    filtered_data['email'].str.contains(search_term, case=False) |
-                    filtered_data['first_name'].str.contains(search_term, case=False) |
-                    filtered_data['last_name'].str.contains(search_term, case=False)
-                ]
+                mask &= test_data[SEARCH_COLUMN].str.contains(search_term.lower(), regex=False, na=False).to_numpy()
             
             if filter_segment:
-                filtered_data = filtered_data[filtered_data['segment_name'].isin(filter_segment)]
+                mask &= test_data['segment_name'].isin(filter_segment).to_numpy()
             
             if filter_category:
-                filtered_data = filtered_data[filtered_data['primary_category'].isin(filter_category)]
+                mask &= test_data['primary_category'].isin(filter_category).to_numpy()
+            
+            filtered_data = test_data[mask]
             
             # Check if we're in edit mode
             if st.session_state.edit_mode and st.session_state.edit_index is not None:
@@ -300,7 +423,7 @@ def main():
                         with col2:
                             segment = st.selectbox("Customer Segment", DEFAULT_SEGMENTS, index=DEFAULT_SEGMENTS.index(customer['segment_name']) if customer['segment_name'] in DEFAULT_SEGMENTS else 0)
                             category = st.selectbox("Primary Product Category", DEFAULT_CATEGORIES, index=DEFAULT_CATEGORIES.index(customer['primary_category']) if customer['primary_category'] in DEFAULT_CATEGORIES else 0)
-                            gender = st.selectbox("Gender", ["Male", "Female", "Other"], index=["Male", "Female", "Other"].index(customer['gender']) if customer['gender'] in ["Male", "Female", "Other"] else 0)
+                            gender = st.selectbox("Gender", GENDER_OPTIONS, index=GENDER_OPTIONS.index(customer['gender']) if customer['gender'] in GENDER_OPTIONS else 0)
                         
                         # Additional information
                         col3, col4 = st.columns(2)
@@ -357,40 +480,31 @@ def main():
                 if not filtered_data.empty:
                     st.markdown("### Customer List")
                     
-                    # Create a container for the table
-                    table_container = st.container()
+                    # Display the filtered customers as a single table
+                    st.dataframe(
+                        filtered_data[['email', 'first_name', 'last_name', 'segment_name', 'primary_category', 'total_spent']],
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={
+                            'total_spent': st.column_config.NumberColumn("Total Spent", format="$%.2f")
+                        }
+                    )
                     
-                    with table_container:
-                        # Display each customer with edit options
-                        for i, (index, row) in enumerate(filtered_data.iterrows()):
-                            # Find the index in the original dataframe
-                            orig_index = test_data.index[test_data['customer_id'] == row['customer_id']].tolist()[0] if 'customer_id' in test_data.columns else index
-                            
-                            # Create a row for each customer
-                            cols = st.columns([3, 2, 2, 2, 1.5, 1.5])
-                            
-                            with cols[0]:
-                                st.write(f"**{row['email']}**")
-                            
-                            with cols[1]:
-                                st.write(f"{row['first_name']} {row['last_name']}")
-                            
-                            with cols[2]:
-                                st.write(f"Segment: {row['segment_name']}")
-                            
-                            with cols[3]:
-                                st.write(f"Category: {row['primary_category']}")
-                            
-                            with cols[4]:
-                                st.write(f"${row['total_spent']:.2f}")
-                            
-                            with cols[5]:
-                                if st.button(f"Edit", key=f"edit_{i}"):
-                                    start_edit_mode(orig_index)
-                                    st.rerun()
-                            
-                            # Add a separator
-                            st.markdown("---")
+                    # Select a customer to edit. filtered_data keeps the original index labels,
+                    # so the selected option is already the index into test_data.
+                    customer_labels = dict(zip(
+                        filtered_data.index,
+                        filtered_data['email'].astype(str) + " (" + filtered_data['customer_id'].astype(str) + ")"
+                    ))
+                    edit_index = st.selectbox(
+                        "Select customer to edit",
+                        options=list(customer_labels),
+                        format_func=customer_labels.get
+                    )
+                    
+                    if st.button("Edit Selected Customer"):
+                        start_edit_mode(edit_index)
+                        st.rerun()
                 else:
                     st.warning("No customers match the search criteria.")
             
@@ -398,26 +512,21 @@ def main():
             if st.button("Delete All Test Data"):
                 if st.checkbox("I understand this will delete ALL test customer data"):
                     # Create empty dataframe with required columns
-                    empty_df = pd.DataFrame(columns=[
-                        'customer_id', 'email', 'first_name', 'last_name', 
-                        'segment_name', 'primary_category', 'age', 'gender', 'city',
-                        'last_purchase_date', 'total_spent'
-                    ])
+                    empty_df = pd.DataFrame(columns=TEST_DATA_COLUMNS)
                     
                     # Save empty dataframe
                     if save_test_data(empty_df):
                         st.success("All test customer data deleted successfully!")
                         st.info("Refresh the page to see the updated data.")
             
-            # Export data button
-            if st.download_button(
+            # Export data button (the browser download is the confirmation)
+            st.download_button(
                 "Export Test Data",
-                test_data.to_csv(index=False).encode('utf-8'),
-                "test_customers.csv",
-                "text/csv",
+                data=get_export_csv(),
+                file_name="test_customers.csv",
+                mime="text/csv",
                 key='download-csv'
-            ):
-                st.success("Test data exported successfully!")
+            )
     
     with tab3:
         st.markdown('<h2 class="sub-header">Generate Random Test Data</h2>', unsafe_allow_html=True)
@@ -442,42 +551,28 @@ def main():
             if st.session_state.edited_data is None:
                 st.session_state.edited_data = st.session_state.random_data.copy()
             
-            # Create a form for editing emails
+            # Create a form for editing emails - only the email column is editable
             with st.form("edit_emails_form"):
-                # Create a container for the email editing interface
-                for i, row in enumerate(st.session_state.edited_data.iterrows()):
-                    idx, data = row
-                    cols = st.columns([3, 2, 2, 3])
-                    
-                    with cols[0]:
-                        st.write(f"{data['first_name']} {data['last_name']}")
-                    
-                    with cols[1]:
-                        st.write(f"Segment: {data['segment_name']}")
-                    
-                    with cols[2]:
-                        st.write(f"Category: {data['primary_category']}")
-                    
-                    with cols[3]:
-                        new_email = st.text_input(f"Email {i+1}", value=data['email'], key=f"email_{i}")
-                        st.session_state.edited_data.at[idx, 'email'] = new_email
+                edited_emails = st.data_editor(
+                    st.session_state.edited_data,
+                    disabled=[col for col in st.session_state.edited_data.columns if col != 'email'],
+                    use_container_width=True,
+                    hide_index=True,
+                    num_rows="fixed",
+                    key="email_editor"
+                )
                 
                 # Submit button
                 submit_emails_button = st.form_submit_button("Update Emails")
             
             if submit_emails_button:
+                st.session_state.edited_data = edited_emails
                 st.success("Emails updated successfully!")
             
-            # Display the updated data
-            st.dataframe(st.session_state.edited_data, use_container_width=True)
-            
             # Add button - separate from generate button
             if st.button("Add to Test Customers"):
-                # Combine existing and generated data
-                combined_data = pd.concat([test_data, st.session_state.edited_data], ignore_index=True)
-                
-                # Save combined data
-                if save_test_data(combined_data):
+                # Append the generated data to the file (after any pending customers)
+                if flush_pending_rows() and append_test_data(st.session_state.edited_data):
                     st.success(f"{len(st.session_state.edited_data)} random customers added successfully!")
                     # Clear the session state
                     st.session_state.random_data = None
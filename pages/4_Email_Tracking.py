@@ -5,19 +5,17 @@ This page provides tracking endpoints for email opens and clicks,
 and shows tracking statistics.
 """
 import os
+import html
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import plotly.express as px
-import base64
 import urllib.parse
 import json
-from PIL import Image
-import io
 
 # Import custom modules
-from src.email.email_tracker import EmailTracker
+from src.email.email_tracker import EmailTracker, TrackingEventBuffer, count_events_per_day, decode_tracking_url
 from src.email.campaign_manager import CampaignManager
 
 # Set page configuration
@@ -33,10 +31,70 @@ os.makedirs("data/campaigns", exist_ok=True)
 os.makedirs("data/campaigns/results", exist_ok=True)
 os.makedirs("data/email_tracking", exist_ok=True)
 
+# Rows of the campaigns table sent before "Load all" is ticked
+CAMPAIGN_TABLE_ROWS = 50
+
 # Initialize trackers
 email_tracker = EmailTracker()
 campaign_manager = CampaignManager()
 
+# Cached reads of campaign and tracking data, shared across reruns
+@st.cache_data(ttl=30)
+def load_campaigns():
+    """Load the campaigns table"""
+    return campaign_manager.get_campaigns()
+
+@st.cache_data(ttl=30)
+def load_open_stats(campaign_id=None, columns=None):
+    """Load recorded opens, optionally for a single campaign and a subset of columns"""
+    return email_tracker.get_open_stats(campaign_id, columns)
+
+@st.cache_data(ttl=30)
+def load_click_stats(campaign_id=None, columns=None):
+    """Load recorded clicks, optionally for a single campaign and a subset of columns"""
+    clicks_df = email_tracker.get_click_stats(campaign_id, columns)
+    
+    # Links repeat across clicks, so store them dictionary-encoded
+    if 'link_url' in clicks_df:
+        clicks_df = clicks_df.assign(link_url=clicks_df['link_url'].astype('category'))
+    
+    return clicks_df
+
+@st.cache_data(ttl=30)
+def load_open_aggregates():
+    """Load open totals and daily counts across all campaigns"""
+    return email_tracker.get_open_aggregates()
+
+@st.cache_data(ttl=30)
+def load_click_aggregates():
+    """Load click totals and daily counts across all campaigns"""
+    return email_tracker.get_click_aggregates()
+
+# Store campaign stats after buffered tracking events are written
+def update_tracked_campaigns(campaign_stats):
+    """Save the stats of campaigns that received tracking events"""
+    for campaign_id, stats in campaign_stats.items():
+        campaign_manager.update_campaign_status(campaign_id, "Tracked", stats)
+    
+    load_open_stats.clear()
+    load_click_stats.clear()
+    load_open_aggregates.clear()
+    load_click_aggregates.clear()
+    load_campaigns.clear()
+
+# Shared buffer so tracking hits don't write to disk on every request
+@st.cache_resource
+def get_tracking_buffer():
+    """Create the process-wide tracking event buffer"""
+    return TrackingEventBuffer(email_tracker, on_flush=update_tracked_campaigns)
+
+# Format a percentage column from two count columns
+def format_rate(numerator, denominator):
+    """Format numerator/denominator as a percentage string, or N/A where the denominator is zero"""
+    den = denominator.to_numpy(dtype=float)
+    rate = np.divide(numerator.to_numpy(dtype=float) * 100, den, out=np.full(len(den), np.nan), where=den > 0)
+    return pd.Series(rate, index=numerator.index).map(lambda x: f"{x:.1f}%" if np.isfinite(x) else "N/A")
+
 # Custom CSS
 def load_css():
     st.markdown("""
@@ -106,73 +164,64 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
-# Create a 1x1 pixel image for tracking
-def create_tracking_pixel():
-    """Create a 1x1 transparent pixel for tracking email opens"""
-    img = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    return buffer.getvalue()
+# 1x1 transparent PNG, inlined as a data URI so it skips Streamlit's media server
+TRACKING_PIXEL_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+TRACKING_PIXEL_HTML = f'<img src="data:image/png;base64,{TRACKING_PIXEL_B64}" width="1" height="1" alt="">'
 
 # Main function
 def main():
-    # Load CSS
-    load_css()
-    
     # Get the query parameters
     query_params = st.query_params
+    action = query_params.get('action')
     
     # Check if this is a tracking request
-    if 'action' in query_params and query_params['action'] in ['open', 'click']:
+    if action in ('open', 'click'):
         # Handle tracking request
-        action = query_params['action']
+        tracking_id = query_params.get('tid')
+        campaign_id = query_params.get('cid')
+        customer_id = query_params.get('uid')
+        email = query_params.get('email', 'unknown@example.com')
+        encoded_url = query_params.get('url')
         
-        if action == 'open' and all(param in query_params for param in ['tid', 'cid', 'uid']):
-            # Record email open
-            tracking_id = query_params['tid']
-            campaign_id = query_params['cid']
-            customer_id = query_params['uid']
-            email = query_params.get('email', 'unknown@example.com')
-            
-            # Record the open
-            email_tracker.record_open(tracking_id, campaign_id, customer_id, email)
-            
-            # Update campaign stats
-            stats = email_tracker.update_campaign_stats(campaign_id)
-            campaign_manager.update_campaign_status(campaign_id, "Tracked", stats)
+        if not (tracking_id and campaign_id and customer_id) or (action == 'click' and not encoded_url):
+            st.error("Invalid tracking request")
+        
+        elif action == 'open':
+            # Queue the open; it is written and counted with the next flush
+            get_tracking_buffer().add_open(tracking_id, campaign_id, customer_id, email)
             
             # Return a tracking pixel
-            st.image(create_tracking_pixel(), width=1)
+            components.html(TRACKING_PIXEL_HTML, height=1)
             
-        elif action == 'click' and all(param in query_params for param in ['tid', 'cid', 'uid', 'url']):
+        else:
             # Record email click
-            tracking_id = query_params['tid']
-            campaign_id = query_params['cid']
-            customer_id = query_params['uid']
-            email = query_params.get('email', 'unknown@example.com')
             link_id = query_params.get('lid', 'unknown')
             
             # Decode URL
-            encoded_url = query_params['url']
-            try:
-                url = base64.urlsafe_b64decode(encoded_url.encode()).decode()
-            except:
-                url = "unknown"
-            
-            # Record the click
-            email_tracker.record_click(tracking_id, campaign_id, customer_id, email, link_id, url)
+            url = decode_tracking_url(encoded_url)
             
-            # Update campaign stats
-            stats = email_tracker.update_campaign_stats(campaign_id)
-            campaign_manager.update_campaign_status(campaign_id, "Tracked", stats)
+            # Queue the click; it is written and counted with the next flush
+            get_tracking_buffer().add_click(tracking_id, campaign_id, customer_id, email, link_id, url)
             
-            # Redirect to the original URL
-            st.markdown(f'<meta http-equiv="refresh" content="0;URL=\'{url}\'">', unsafe_allow_html=True)
+            # Redirect to the original URL from the main document; component iframes are sandboxed
+            # without top navigation, so a script there can not leave the page
+            if url.startswith(('http://', 'https://')):
+                target = html.escape(url, quote=True)
+                st.markdown(f'<meta http-equiv="refresh" content="0;url={target}">', unsafe_allow_html=True)
+                st.link_button("Continue to link", url)
+            else:
+                st.error("Invalid tracking link")
         
-        else:
-            st.error("Invalid tracking request")
+        # Tracking hits only need the pixel or redirect, so skip the page layout
+        st.stop()
     
     else:
+        # Plotly is only needed for the page itself, not for tracking hits
+        import plotly.express as px
+        
+        # Load CSS
+        load_css()
+        
         # Display the normal page content
         st.markdown('<h1 class="main-header">Email Tracking</h1>', unsafe_allow_html=True)
         
@@ -208,7 +257,7 @@ def main():
             st.markdown('<h2 class="sub-header">Campaign Tracking</h2>', unsafe_allow_html=True)
             
             # Get campaigns
-            campaigns_df = campaign_manager.get_campaigns()
+            campaigns_df = load_campaigns()
             
             if campaigns_df.empty:
                 st.info("No campaigns have been created yet.")
@@ -216,46 +265,34 @@ def main():
                 # Display all campaigns
                 st.markdown("### All Campaigns")
                 
-                # Format dataframe for display
-                display_df = campaigns_df.copy()
-                
-                # Rename columns
-                display_df = display_df.rename(columns={
-                    'campaign_id': 'Campaign ID',
-                    'campaign_name': 'Campaign Name',
-                    'campaign_type': 'Type',
-                    'emails_sent': 'Emails Sent',
-                    'emails_opened': 'Opens',
-                    'emails_clicked': 'Clicks',
-                    'created_date': 'Created Date',
-                    'executed_date': 'Executed Date',
-                    'status': 'Status'
-                })
-                
-                # Calculate rates for campaigns with emails sent
-                display_df['Open Rate'] = display_df.apply(
-                    lambda row: f"{(row['Opens'] / row['Emails Sent'] * 100):.1f}%" if row['Emails Sent'] > 0 else "N/A",
-                    axis=1
-                )
-                
-                display_df['Click Rate'] = display_df.apply(
-                    lambda row: f"{(row['Clicks'] / row['Emails Sent'] * 100):.1f}%" if row['Emails Sent'] > 0 else "N/A",
-                    axis=1
-                )
-                
-                display_df['CTR'] = display_df.apply(
-                    lambda row: f"{(row['Clicks'] / row['Opens'] * 100):.1f}%" if row['Opens'] > 0 else "N/A",
-                    axis=1
-                )
-                
-                # Select columns for display
-                display_df = display_df[[
-                    'Campaign Name', 'Created Date', 'Executed Date', 'Status', 'Emails Sent', 
-                    'Opens', 'Open Rate', 'Clicks', 'Click Rate'
-                ]]
-                
-                # Display dataframe
-                st.dataframe(display_df, use_container_width=True)
+                # The table is only built and sent to the browser when requested
+                if st.checkbox("Show campaign table", value=False, key="show_campaign_table"):
+                    # Select and rename the displayed columns in one pass
+                    display_df = campaigns_df[[
+                        'campaign_name', 'created_date', 'executed_date', 'status',
+                        'emails_sent', 'emails_opened', 'emails_clicked'
+                    ]].rename(columns={
+                        'campaign_name': 'Campaign Name',
+                        'created_date': 'Created Date',
+                        'executed_date': 'Executed Date',
+                        'status': 'Status',
+                        'emails_sent': 'Emails Sent',
+                        'emails_opened': 'Opens',
+                        'emails_clicked': 'Clicks'
+                    })
+                    
+                    # Calculate rates for campaigns with emails sent
+                    display_df.insert(6, 'Open Rate', format_rate(display_df['Opens'], display_df['Emails Sent']))
+                    display_df['Click Rate'] = format_rate(display_df['Clicks'], display_df['Emails Sent'])
+                    
+                    # Send only the first rows unless the full table is requested
+                    if len(display_df) > CAMPAIGN_TABLE_ROWS and not st.checkbox(
+                        f"Load all {len(display_df)} campaigns", key="load_all_campaigns"
+                    ):
+                        display_df = display_df.head(CAMPAIGN_TABLE_ROWS)
+                    
+                    # Display dataframe
+                    st.dataframe(display_df, use_container_width=True)
                 
                 # Filter campaigns with emails sent for detailed tracking
                 campaigns_with_emails = campaigns_df[campaigns_df['emails_sent'] > 0]
@@ -267,15 +304,18 @@ def main():
                     st.markdown("### Detailed Email Tracking")
                     st.info("Select a campaign that has sent emails to view detailed tracking information.")
                     
+                    # Map IDs to names once instead of filtering the frame per option
+                    campaign_names = dict(zip(campaigns_with_emails['campaign_id'], campaigns_with_emails['campaign_name']))
+                    
                     selected_campaign_id = st.selectbox(
                         "Select Campaign for Detailed Tracking",
-                        options=campaigns_with_emails['campaign_id'].tolist(),
-                        format_func=lambda x: f"{x} - {campaigns_with_emails[campaigns_with_emails['campaign_id'] == x]['campaign_name'].values[0]}"
+                        options=list(campaign_names),
+                        format_func=lambda x: f"{x} - {campaign_names[x]}"
                     )
                     
                     if selected_campaign_id:
-                        # Get campaign data
-                        campaign_data = campaign_manager.get_campaign(selected_campaign_id)
+                        # Get campaign data from the already loaded campaigns table
+                        campaign_data = campaigns_with_emails.set_index('campaign_id').loc[selected_campaign_id].to_dict()
                         
                         if campaign_data:
                             # Display campaign metrics
@@ -299,26 +339,22 @@ def main():
                                 st.metric("CTR", ctr)
                             
                             # Get detailed tracking data
-                            opens_df = email_tracker.get_open_stats(selected_campaign_id)
-                            clicks_df = email_tracker.get_click_stats(selected_campaign_id)
+                            opens_df = load_open_stats(selected_campaign_id, ['timestamp'])
+                            clicks_df = load_click_stats(selected_campaign_id, ['timestamp', 'link_url'])
                             
                             # Display opens over time
                             if not opens_df.empty:
                                 st.markdown("### Opens Over Time")
                                 
-                                # Convert timestamp to datetime
-                                opens_df['timestamp'] = pd.to_datetime(opens_df['timestamp'])
-                                
-                                # Group by date and count opens
-                                opens_by_date = opens_df.groupby(opens_df['timestamp'].dt.date).size().reset_index(name='opens')
+                                # Count opens per day
+                                opens_by_date = count_events_per_day(opens_df['timestamp'])
                                 
                                 # Create chart
                                 fig = px.line(
-                                    opens_by_date,
-                                    x='timestamp',
-                                    y='opens',
+                                    x=opens_by_date.index,
+                                    y=opens_by_date.values,
                                     title="Email Opens Over Time",
-                                    labels={'timestamp': 'Date', 'opens': 'Number of Opens'}
+                                    labels={'x': 'Date', 'y': 'Number of Opens'}
                                 )
                                 
                                 # Add transparent legend background
@@ -332,19 +368,15 @@ def main():
                             if not clicks_df.empty:
                                 st.markdown("### Clicks Over Time")
                                 
-                                # Convert timestamp to datetime
-                                clicks_df['timestamp'] = pd.to_datetime(clicks_df['timestamp'])
-                                
-                                # Group by date and count clicks
-                                clicks_by_date = clicks_df.groupby(clicks_df['timestamp'].dt.date).size().reset_index(name='clicks')
+                                # Count clicks per day
+                                clicks_by_date = count_events_per_day(clicks_df['timestamp'])
                                 
                                 # Create chart
                                 fig = px.line(
-                                    clicks_by_date,
-                                    x='timestamp',
-                                    y='clicks',
+                                    x=clicks_by_date.index,
+                                    y=clicks_by_date.values,
                                     title="Email Clicks Over Time",
-                                    labels={'timestamp': 'Date', 'clicks': 'Number of Clicks'}
+                                    labels={'x': 'Date', 'y': 'Number of Clicks'}
                                 )
                                 
                                 # Add transparent legend background
@@ -358,8 +390,7 @@ def main():
                                 st.markdown("### Most Clicked Links")
                                 
                                 # Group by link URL and count clicks
-                                links_df = clicks_df.groupby('link_url').size().reset_index(name='clicks')
-                                links_df = links_df.sort_values('clicks', ascending=False).head(10)
+                                links_df = clicks_df.groupby('link_url', observed=True).size().nlargest(10).reset_index(name='clicks')
                                 
                                 # Create chart
                                 fig = px.bar(
@@ -383,87 +414,49 @@ def main():
         with tab2:
             st.markdown('<h2 class="sub-header">Tracking Analytics</h2>', unsafe_allow_html=True)
             
-            # Get all tracking data
-            opens_df = email_tracker.get_open_stats()
-            clicks_df = email_tracker.get_click_stats()
+            # Get aggregated tracking data
+            opens = load_open_aggregates()
+            clicks = load_click_aggregates()
             
-            if opens_df.empty and clicks_df.empty:
+            if opens['total'] == 0 and clicks['total'] == 0:
                 st.info("No tracking data available yet.")
             else:
                 # Overall metrics
                 st.markdown("### Overall Tracking Metrics")
                 
-                # Calculate metrics
-                total_opens = len(opens_df)
-                total_clicks = len(clicks_df)
-                unique_opens = len(opens_df['customer_id'].unique()) if not opens_df.empty else 0
-                unique_clicks = len(clicks_df['customer_id'].unique()) if not clicks_df.empty else 0
-                
                 col1, col2, col3, col4 = st.columns(4)
                 
                 with col1:
-                    st.metric("Total Opens", total_opens)
+                    st.metric("Total Opens", opens['total'])
                 
                 with col2:
-                    st.metric("Unique Opens", unique_opens)
+                    st.metric("Unique Opens", opens['unique'])
                 
                 with col3:
-                    st.metric("Total Clicks", total_clicks)
+                    st.metric("Total Clicks", clicks['total'])
                 
                 with col4:
-                    st.metric("Unique Clicks", unique_clicks)
+                    st.metric("Unique Clicks", clicks['unique'])
                 
-                # Display opens over time
-                if not opens_df.empty:
-                    st.markdown("### Overall Opens Over Time")
-                    
-                    # Convert timestamp to datetime
-                    opens_df['timestamp'] = pd.to_datetime(opens_df['timestamp'])
-                    
-                    # Group by date and count opens
-                    opens_by_date = opens_df.groupby(opens_df['timestamp'].dt.date).size().reset_index(name='opens')
-                    
-                    # Create chart
-                    fig = px.line(
-                        opens_by_date,
-                        x='timestamp',
-                        y='opens',
-                        title="Email Opens Over Time (All Campaigns)",
-                        labels={'timestamp': 'Date', 'opens': 'Number of Opens'}
-                    )
-                    
-                    # Add transparent legend background
-                    fig.update_layout(
-                        legend=dict(bgcolor='rgba(0,0,0,0)')
-                    )
-                    
-                    st.plotly_chart(fig, use_container_width=True)
+                # Display opens and clicks over time in one chart
+                st.markdown("### Overall Engagement Over Time")
                 
-                # Display clicks over time
-                if not clicks_df.empty:
-                    st.markdown("### Overall Clicks Over Time")
-                    
-                    # Convert timestamp to datetime
-                    clicks_df['timestamp'] = pd.to_datetime(clicks_df['timestamp'])
-                    
-                    # Group by date and count clicks
-                    clicks_by_date = clicks_df.groupby(clicks_df['timestamp'].dt.date).size().reset_index(name='clicks')
-                    
-                    # Create chart
-                    fig = px.line(
-                        clicks_by_date,
-                        x='timestamp',
-                        y='clicks',
-                        title="Email Clicks Over Time (All Campaigns)",
-                        labels={'timestamp': 'Date', 'clicks': 'Number of Clicks'}
-                    )
-                    
-                    # Add transparent legend background
-                    fig.update_layout(
-                        legend=dict(bgcolor='rgba(0,0,0,0)')
-                    )
-                    
-                    st.plotly_chart(fig, use_container_width=True)
+                # Align the daily opens and clicks on a shared date index
+                daily = pd.concat({'Opens': opens['daily'], 'Clicks': clicks['daily']}, axis=1).fillna(0).rename_axis('Date')
+                
+                # Create chart
+                fig = px.line(
+                    daily,
+                    title="Email Opens and Clicks Over Time (All Campaigns)",
+                    labels={'value': 'Count', 'variable': 'Event'}
+                )
+                
+                # Add transparent legend background
+                fig.update_layout(
+                    legend=dict(bgcolor='rgba(0,0,0,0)')
+                )
+                
+                st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -8,14 +8,17 @@ import os
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pyarrow as pa  # Installed with streamlit, which sends every dataframe to the browser as Arrow
 from datetime import datetime
 import time
 import json
 import smtplib
+import textwrap
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Import custom modules
-from src.email.email_sender import EmailSender, EmailTemplateManager
-from src.email.campaign_manager import CampaignManager
+from src.email.email_sender import EmailSender, EmailTemplateManager, SendRateLimiter, get_template_fields
 from dotenv import load_dotenv
 
 # Set page configuration
@@ -32,8 +35,10 @@ if 'campaign_id' not in st.session_state:
     st.session_state.campaign_id = None
 if 'campaign_summary' not in st.session_state:
     st.session_state.campaign_summary = {}
-if 'filtered_customers' not in st.session_state:
-    st.session_state.filtered_customers = pd.DataFrame()
+if 'filtered_positions' not in st.session_state:
+    st.session_state.filtered_positions = np.array([], dtype=np.intp)
+if 'test_data_mtime' not in st.session_state:
+    st.session_state.test_data_mtime = None
 if 'selected_templates' not in st.session_state:
     st.session_state.selected_templates = {}
 if 'email_preview_customer' not in st.session_state:
@@ -44,13 +49,23 @@ if 'test_mode' not in st.session_state:
     st.session_state.test_mode = True
 if 'execution_confirmed' not in st.session_state:
     st.session_state.execution_confirmed = False
+if 'recipients_page' not in st.session_state:
+    st.session_state.recipients_page = 0
 
 # Constants
 TEST_DATA_PATH = "data/test_customers.csv"
+SEND_WORKERS = 4  # SMTP connections used to send a campaign in parallel
+SEND_RATE_LIMIT = 10  # Emails per second across all connections
+SEND_BATCH_SIZE = 10  # Recipients per task handed to a send worker
+ABORT_MIN_ATTEMPTS = 30  # Sends attempted before the failure rate can abort a campaign
+ABORT_FAILURE_RATE = 1 / 3  # Failure rate that aborts a campaign, since the server is likely rejecting us
+CATEGORY_COLUMNS = ('segment_name', 'primary_category', 'gender')
+RECIPIENT_COLUMNS = ['email', 'first_name', 'last_name', 'segment_name', 'primary_category']
+RECIPIENTS_PAGE_SIZE = 1000  # Rows of the test recipients table sent to the browser at a time
+DIAGNOSTIC_SMTP_REUSE_SECONDS = 60  # How long a tested SMTP login is reused by the diagnostics
 
-# Custom CSS
-def load_css():
-    st.markdown("""
+# Custom CSS, with whitespace collapsed to keep the per-rerun payload small
+CUSTOM_CSS = " ".join("""
     <style>
         .main-header {
             font-size: 2.5rem;
@@ -101,42 +116,129 @@ def load_css():
             word-wrap: break-word;
         }
     </style>
-    """, unsafe_allow_html=True)
+""".split())
+
+def load_css():
+    # Streamlit drops elements that a rerun does not emit again, so the style block is sent every run
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+# Function to read the test data file (cached until the file changes)
+@st.cache_data(show_spinner=False)
+def load_test_data_file(path, mtime):
+    """Parse the test customer CSV; mtime is only part of the cache key"""
+    test_data = pd.read_csv(path)
+    
+    # Targeting columns have a handful of repeated labels, so filter and group them by category codes
+    for column in CATEGORY_COLUMNS:
+        if column in test_data.columns:
+            test_data[column] = test_data[column].astype('category')
+    
+    return test_data
+
+# Function to prepare test customers for email templates (cached until the file changes)
+@st.cache_data(show_spinner=False)
+def prepare_test_data_for_email(path, mtime):
+    """Add the email template fields to the test customers; mtime is only part of the cache key"""
+    return EmailTemplateManager.prepare_customer_data_for_email(load_test_data_file(path, mtime))
+
+# Function to count test customers per target (cached until the file changes)
+@st.cache_data(show_spinner=False)
+def get_target_counts(path, mtime):
+    """Count test customers per segment and per category; mtime is only part of the cache key"""
+    test_data = load_test_data_file(path, mtime)
+    return (
+        test_data['segment_name'].value_counts().sort_index(),
+        test_data['primary_category'].value_counts().sort_index()
+    )
 
-# Function to load test data
-def load_test_data():
-    """Load test customer data from CSV file"""
+# Function to index test customer positions by segment and by category (cached until the file changes)
+@st.cache_data(show_spinner=False)
+def get_target_positions(path, mtime):
+    """Map each segment and category to the positions of its customers; mtime is only part of the cache key"""
+    email_ready_customers = prepare_test_data_for_email(path, mtime)
+    return {
+        column: email_ready_customers.groupby(column, observed=True, sort=False).indices
+        for column in ('segment_name', 'primary_category')
+    }
+
+# Function to load the test data summary
+def load_test_data_counts():
+    """Load the test data mtime and its customer counts per segment and category, or None if it can not be loaded"""
     try:
         if os.path.exists(TEST_DATA_PATH):
-            return pd.read_csv(TEST_DATA_PATH)
+            test_data_mtime = os.path.getmtime(TEST_DATA_PATH)
+            return (test_data_mtime, *get_target_counts(TEST_DATA_PATH, test_data_mtime))
         else:
             st.error(f"Test data file not found at {TEST_DATA_PATH}. Please add test customers first.")
-            return pd.DataFrame()
+            return None
     except Exception as e:
         st.error(f"Error loading test data: {e}")
+        return None
+
+# Function to get the campaign's customers from the positions stored at setup
+def get_filtered_customers():
+    """Take the filtered customers out of the cached email-ready test data"""
+    positions = st.session_state.filtered_positions
+    if positions.size == 0:
         return pd.DataFrame()
+    return prepare_test_data_for_email(TEST_DATA_PATH, st.session_state.test_data_mtime).take(positions)
+
+# Function to get the recipient table shown for a test run (cached per file version and selection)
+@st.cache_data(ttl=300, max_entries=16, show_spinner=False)
+def get_test_recipients_table(mtime, positions):
+    """Build the displayed recipient columns as an Arrow table; mtime and the positions array form the cache key"""
+    recipients = prepare_test_data_for_email(TEST_DATA_PATH, mtime).take(positions)[RECIPIENT_COLUMNS]
+    
+    # Low-cardinality labels become Arrow dictionary columns, which keeps the payload small
+    # (already categorical when loaded, except a primary_category derived from 'category')
+    recipients = recipients.astype({'segment_name': 'category', 'primary_category': 'category'})
+    
+    # Convert once here so reruns hand st.dataframe a ready Arrow table instead of re-converting the frame
+    return pa.Table.from_pandas(recipients, preserve_index=False)
+
+# Email settings from .env, read once per process (use "Reload Email Configuration" after editing .env)
+@st.cache_resource(show_spinner=False)
+def load_email_config():
+    load_dotenv(override=True)
+    return {
+        'host': os.getenv("EMAIL_HOST", "smtp.gmail.com"),
+        'port': int(os.getenv("EMAIL_PORT", "465")),
+        'username': os.getenv("EMAIL_USER", ""),
+        'password': os.getenv("EMAIL_PASSWORD", "")
+    }
+
+# Email templates are static, so build them once and share them (read-only)
+@st.cache_resource(show_spinner=False)
+def load_segment_templates():
+    return EmailTemplateManager.get_segment_templates()
+
+@st.cache_resource(show_spinner=False)
+def load_category_templates():
+    return EmailTemplateManager.get_category_templates()
 
 # Function to create email preview
 def create_email_preview(template, customer_data):
     try:
-        subject = template['subject'].format(**customer_data)
-        body_html = template['body_html'].format(**customer_data)
-        
-        st.markdown('<div class="email-preview">', unsafe_allow_html=True)
+        # Only pass the fields the templates actually use
+        fields = get_template_fields(template['subject']) + get_template_fields(template['body_html'])
+        values = {field: customer_data[field] for field in fields}
         
-        # Email header
-        st.markdown('<div class="email-header">', unsafe_allow_html=True)
-        st.markdown(f'<div class="email-subject">Subject: {subject}</div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="email-from">From: Mall Marketing Team &lt;marketing@mall.com&gt;</div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="email-to">To: {customer_data["email"]}</div>', unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
+        subject = template['subject'].format_map(values)
+        body_html = template['body_html'].format_map(values)
         
-        # Email body
-        st.markdown('<div class="email-body">', unsafe_allow_html=True)
-        st.markdown(body_html, unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+        # Email header and body in a single markdown element; the body is dedented
+        # so its template indentation isn't rendered as a code block
+        st.markdown(
+            '<div class="email-preview">'
+            '<div class="email-header">'
+            f'<div class="email-subject">Subject: {subject}</div>'
+            '<div class="email-from">From: Mall Marketing Team &lt;marketing@mall.com&gt;</div>'
+            f'<div class="email-to">To: {customer_data["email"]}</div>'
+            '</div>'
+            f'<div class="email-body">{textwrap.dedent(body_html).strip()}</div>'
+            '</div>',
+            unsafe_allow_html=True
+        )
         
         return True
     except KeyError as e:
@@ -147,7 +249,7 @@ def create_email_preview(template, customer_data):
         return False
 
 # Callback for campaign setup form
-def handle_campaign_setup_form(target_type, campaign_name, target_segments, target_categories, test_mode, max_emails, email_user, email_password, email_host, email_port, email_ready_customers, selected_templates):
+def handle_campaign_setup_form(target_type, campaign_name, target_segments, target_categories, test_mode, max_emails, email_user, email_password, email_host, email_port, email_ready_customers, test_data_mtime, selected_templates):
     # Store the test mode in session state
     st.session_state.test_mode = test_mode
     
@@ -167,28 +269,36 @@ def handle_campaign_setup_form(target_type, campaign_name, target_segments, targ
     
     # Prepare target data
     if target_type == "Segment-based":
-        # Filter customers by segment
-        filtered_customers = email_ready_customers[email_ready_customers['segment_name'].isin(target_segments)]
-        target_description = ", ".join(target_segments)
+        # Match customers by segment
+        target_column, targets = 'segment_name', target_segments
     else:  # Category-based
-        # Filter customers by category
-        filtered_customers = email_ready_customers[email_ready_customers['primary_category'].isin(target_categories)]
-        target_description = ", ".join(target_categories)
+        # Match customers by category
+        target_column, targets = 'primary_category', target_categories
+    target_description = ", ".join(targets)
+    target_set = frozenset(targets)
     
-    # Limit to max emails
-    if not filtered_customers.empty and len(filtered_customers) > max_emails:
-        filtered_customers = filtered_customers.sample(n=max_emails, random_state=42)
+    # Positions of matching customers from the cached index, sampled down to max emails before taking any rows
+    target_positions = get_target_positions(TEST_DATA_PATH, test_data_mtime)[target_column]
+    positions = np.sort(np.concatenate(
+        [target_positions[target] for target in target_set if target in target_positions] or [np.array([], dtype=np.intp)]
+    ))
+    if positions.size > max_emails:
+        positions = np.random.default_rng(42).choice(positions, max_emails, replace=False)
+    filtered_customers = email_ready_customers.take(positions)
     
     if filtered_customers.empty:
         st.error("No customers match the selected criteria.")
         return False
     
-    # Store the filtered customers and templates in session state
-    st.session_state.filtered_customers = filtered_customers
+    # Store the filtered customer positions and templates in session state
+    # The rows themselves are taken again from the cached test data when needed
+    st.session_state.filtered_positions = positions
+    st.session_state.test_data_mtime = test_data_mtime
     st.session_state.selected_templates = selected_templates
     
     # Store the email preview customer in session state
-    st.session_state.email_preview_customer = filtered_customers.iloc[0].to_dict()
+    # Gather the first customer column by column so values keep their native dtypes
+    st.session_state.email_preview_customer = {column: filtered_customers[column].iat[0] for column in filtered_customers.columns}
     
     # Create email config
     email_config = {
@@ -208,7 +318,9 @@ def handle_campaign_setup_form(target_type, campaign_name, target_segments, targ
         'customer_ids': filtered_customers['customer_id'].tolist() if 'customer_id' in filtered_customers.columns else []
     }
     
-    # Initialize campaign manager
+    # Initialize campaign manager (its dependencies are already loaded, so importing it here only
+    # skips loading the campaign_manager module on renders that never set up or run a campaign)
+    from src.email.campaign_manager import CampaignManager
     campaign_manager = CampaignManager()
     
     # Create campaign
@@ -228,6 +340,7 @@ def handle_campaign_setup_form(target_type, campaign_name, target_segments, targ
         'campaign_name': campaign_name,
         'campaign_type': target_type,
         'target_description': target_description,
+        'target_set': target_set,
         'total_customers': len(filtered_customers),
         'test_mode': test_mode
     }
@@ -246,7 +359,7 @@ def run_test_campaign():
     
     # Get campaign info from session state
     campaign_id = st.session_state.campaign_id
-    filtered_customers = st.session_state.filtered_customers
+    filtered_customers = get_filtered_customers()
     
     # Check if filtered customers is empty
     if filtered_customers.empty:
@@ -254,19 +367,11 @@ def run_test_campaign():
         return
     
     # Initialize campaign manager
+    from src.email.campaign_manager import CampaignManager
     campaign_manager = CampaignManager()
     
     # Simulate sending emails
     with st.spinner("Running test campaign..."):
-        # Update campaign status
-        campaign_manager.update_campaign_status(
-            campaign_id=campaign_id, 
-            status="Testing"
-        )
-        
-        # Simulate processing time
-        time.sleep(2)
-        
         # Create expected results
         results = {
             'emails_sent': len(filtered_customers),
@@ -274,8 +379,8 @@ def run_test_campaign():
             'emails_clicked': 0,
             'test_mode': True,
             'details': [
-                {'email': customer['email'], 'status': 'simulated'} 
-                for _, customer in filtered_customers.iterrows()
+                {'email': email, 'status': 'simulated'}
+                for email in filtered_customers['email'].tolist()
             ]
         }
         
@@ -290,17 +395,141 @@ def run_test_campaign():
     st.session_state.campaign_executed = True
     st.rerun()
 
-# Create a new fixed function for checkbox handling 
-def handle_confirmation_change():
-    """Toggle the execution confirmation state"""
-    if 'execution_confirmed' not in st.session_state:
-        st.session_state.execution_confirmed = False
-    else:
-        st.session_state.execution_confirmed = not st.session_state.execution_confirmed
-    print(f"Execution confirmed: {st.session_state.execution_confirmed}")  # Debug log
+# Callback for moving through the test recipients table
+def change_recipients_page(step):
+    st.session_state.recipients_page += step
+
+# Function to send a campaign over several SMTP connections
+def send_emails_in_parallel(email_sender, customers, target_templates, target_column, campaign_id, on_progress=None):
+    """
+    Queue recipients in small batches for worker threads sharing one sender's SMTP connection pool, and merge their results.
+    
+    Returns the per-target counts and whether sending was aborted because too many sends failed.
+    """
+    worker_count = max(1, min(email_sender.concurrency, len(customers)))
+    
+    def send_chunk(positions):
+        return email_sender.send_segment_emails(
+            customers=customers.take(positions),
+            segment_templates=target_templates,
+            segment_column=target_column,
+            test_mode=False,
+            campaign_id=campaign_id
+        )
+    
+    # Small batches keep every worker busy until the queue is empty, even when some sends are slow
+    # Add up the per-target counts from every batch as it finishes
+    results = {target: Counter(success=0, failed=0, skipped=0) for target in [*target_templates, 'other']}
+    processed = attempted = failed = 0
+    aborted = False
+    try:
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            batches = {
+                executor.submit(send_chunk, positions): len(positions)
+                for positions in np.array_split(np.arange(len(customers)), max(1, -(-len(customers) // SEND_BATCH_SIZE)))
+            }
+            for future in as_completed(batches):
+                if future.cancelled():
+                    continue
+                for target, counts in future.result().items():
+                    results[target].update(counts)
+                    attempted += counts['success'] + counts['failed']
+                    failed += counts['failed']
+                processed += batches[future]
+                if on_progress and len(customers):
+                    on_progress(processed, len(customers))
+                
+                # Stop handing out batches once the server is clearly rejecting the campaign
+                if not aborted and attempted >= ABORT_MIN_ATTEMPTS and failed > attempted * ABORT_FAILURE_RATE:
+                    aborted = True
+                    for pending in batches:
+                        pending.cancel()
+    finally:
+        email_sender.close()
+    
+    return results, aborted
+
+# Email sender shared across reruns and sessions, so its SMTP connection pool and rate limit carry over
+@st.cache_resource(show_spinner=False)
+def get_email_sender(host, port, username, password):
+    return EmailSender(
+        host=host,
+        port=port,
+        username=username,
+        password=password,
+        enable_tracking=True,
+        rate_limiter=SendRateLimiter(SEND_RATE_LIMIT),
+        concurrency=SEND_WORKERS
+    )
+
+# Single background thread that runs real campaigns, shared by all sessions
+@st.cache_resource
+def get_campaign_executor():
+    return ThreadPoolExecutor(max_workers=1)
+
+# Function to send a real campaign; runs on the background executor, so it must not call Streamlit
+def run_real_campaign(email_sender, campaign_id, recipients, target_templates, target_column, progress):
+    """Send the campaign, record its status and return the results to show on the page"""
+    from src.email.campaign_manager import CampaignManager
+    campaign_manager = CampaignManager()
+    
+    try:
+        # Update campaign status
+        campaign_manager.update_campaign_status(
+            campaign_id=campaign_id, 
+            status="Executing"
+        )
+        
+        # Send target-specific emails over several SMTP connections
+        results, aborted = send_emails_in_parallel(
+            email_sender=email_sender,
+            customers=recipients,
+            target_templates=target_templates,
+            target_column=target_column,
+            campaign_id=campaign_id,
+            on_progress=lambda done, total: progress.update(done=done)
+        )
+        
+        # Summarize the per-target results and calculate total sent
+        result_details = [
+            {'segment': segment, 'success': segment_results['success'], 'failed': segment_results['failed']}
+            for segment, segment_results in results.items()
+            if segment != 'other'
+        ]
+        total_sent = sum(detail['success'] for detail in result_details)
+        
+        # Update campaign status
+        campaign_manager.update_campaign_status(
+            campaign_id=campaign_id, 
+            status="Executed",
+            results={
+                'emails_sent': total_sent,
+                'emails_opened': 0,  # Initially 0
+                'emails_clicked': 0,  # Initially 0
+                'test_mode': False,
+                'aborted': aborted,
+                'details': result_details
+            }
+        )
+        
+        # Only the totals go back to the page; the per-target details stay in the saved results
+        return {
+            'total_sent': total_sent,
+            'total_failed': sum(detail['failed'] for detail in result_details),
+            'aborted': aborted
+        }
+        
+    except Exception as e:
+        # Update campaign status
+        campaign_manager.update_campaign_status(
+            campaign_id=campaign_id, 
+            status="Failed",
+            results={'error': str(e)}
+        )
+        raise
 
-# Callback for executing real campaign
-def execute_real_campaign():
+# Callback for executing real campaign with the sender validated on the page
+def execute_real_campaign(email_sender):
     # Check if campaign setup is complete
     if not st.session_state.campaign_setup_complete:
         st.error("Please set up a campaign first.")
@@ -313,7 +542,7 @@ def execute_real_campaign():
     
     # Get campaign info from session state
     campaign_id = st.session_state.campaign_id
-    filtered_customers = st.session_state.filtered_customers
+    filtered_customers = get_filtered_customers()
     selected_templates = st.session_state.selected_templates
     campaign_summary = st.session_state.campaign_summary
     
@@ -327,202 +556,165 @@ def execute_real_campaign():
         st.error("No email templates available for the selected targets.")
         return
     
-    # Get email configuration from .env
-    email_host = os.getenv("EMAIL_HOST", "smtp.gmail.com")
-    email_port = int(os.getenv("EMAIL_PORT", "465"))
-    email_user = os.getenv("EMAIL_USER", "")
-    email_password = os.getenv("EMAIL_PASSWORD", "")
+    # Pick the templates and the column that matches customers to them
+    target_type = campaign_summary['campaign_type']
     
-    # Initialize campaign manager
-    campaign_manager = CampaignManager()
+    if target_type == "Segment-based":
+        # Create segment templates dictionary for the segments stored at setup
+        target_set = campaign_summary['target_set']
+        target_templates = {segment: template for segment, template in selected_templates.items() if segment in target_set}
+        target_column = 'segment_name'
+        
+        # Check if segment templates is empty after filtering
+        if not target_templates:
+            st.error("No templates available for the selected segments.")
+            return
     
-    # Send emails
-    with st.spinner(f"Sending emails..."):
-        try:
-            # Create email sender
-            email_sender = EmailSender(
-                host=email_host,
-                port=email_port,
-                username=email_user,
-                password=email_password,
-                enable_tracking=True
-            )
-            
-            # Update campaign status
-            campaign_manager.update_campaign_status(
-                campaign_id=campaign_id, 
-                status="Executing"
-            )
-            
-            # Send emails based on campaign type
-            results = {}
-            target_type = campaign_summary['campaign_type']
-            
-            if target_type == "Segment-based":
-                # Get target segments from description
-                target_segments = campaign_summary['target_description'].split(", ")
-                
-                # Create segment templates dictionary
-                segment_templates = {segment: selected_templates[segment] for segment in target_segments if segment in selected_templates}
-                
-                # Check if segment templates is empty after filtering
-                if not segment_templates:
-                    st.error("No templates available for the selected segments.")
-                    return
-                
-                # Send segment-specific emails
-                max_emails = len(filtered_customers)
-                results = email_sender.send_segment_emails(
-                    customers=filtered_customers,
-                    segment_templates=segment_templates,
-                    segment_column='segment_name',
-                    test_mode=False,
-                    max_emails_per_segment=max_emails // len(segment_templates) if len(segment_templates) > 0 else max_emails,
-                    campaign_id=campaign_id
-                )
-            
-            else:  # Category-based
-                # Get target categories from description
-                target_categories = campaign_summary['target_description'].split(", ")
-                
-                # Create category templates dictionary
-                category_templates = {}
-                for display_category, template in selected_templates.items():
-                    db_category = display_category.lower().replace(' ', '_')
-                    category_templates[db_category] = template
-                
-                # Check if category templates is empty
-                if not category_templates:
-                    st.error("No templates available for the selected categories.")
-                    return
-                
-                # Send category-specific emails
-                max_emails = len(filtered_customers)
-                results = email_sender.send_segment_emails(
-                    customers=filtered_customers,
-                    segment_templates=category_templates,
-                    segment_column='primary_category',
-                    test_mode=False,
-                    max_emails_per_segment=max_emails // len(category_templates) if len(category_templates) > 0 else max_emails,
-                    campaign_id=campaign_id
-                )
-            
-            # Calculate total sent
-            total_sent = 0
-            result_details = []
-            
-            if isinstance(results, dict):
-                if 'success' in results:
-                    # For bulk emails
-                    total_sent = results['success']
-                    result_details = [{'status': 'summary', 'success': results['success'], 'failed': results['failed']}]
-                else:
-                    # For segment emails
-                    for segment, segment_results in results.items():
-                        if segment != 'other':
-                            total_sent += segment_results['success']
-                            result_details.append({
-                                'segment': segment, 
-                                'success': segment_results['success'], 
-                                'failed': segment_results['failed']
-                            })
-            
-            # Update campaign status
-            campaign_manager.update_campaign_status(
-                campaign_id=campaign_id, 
-                status="Executed",
-                results={
-                    'emails_sent': total_sent,
-                    'emails_opened': 0,  # Initially 0
-                    'emails_clicked': 0,  # Initially 0
-                    'test_mode': False,
-                    'details': result_details
-                }
-            )
-            
-            # Store results in session state
-            st.session_state.campaign_results = {
-                'total_sent': total_sent,
-                'details': result_details
-            }
-            
-            # Set campaign executed flag
-            st.session_state.campaign_executed = True
-            st.rerun()
-            
-        except Exception as e:
-            st.error(f"Error executing campaign: {str(e)}")
-            
-            # Update campaign status
-            campaign_manager.update_campaign_status(
-                campaign_id=campaign_id, 
-                status="Failed",
-                results={'error': str(e)}
-            )
+    else:  # Category-based
+        # Create category templates dictionary keyed by database category
+        target_templates = {
+            display_category.lower().replace(' ', '_'): template
+            for display_category, template in selected_templates.items()
+        }
+        target_column = 'primary_category'
+        
+        # Check if category templates is empty
+        if not target_templates:
+            st.error("No templates available for the selected categories.")
+            return
+    
+    # Apply the per-target limit up front so chunks can be sent independently
+    max_emails_per_target = len(filtered_customers) // len(target_templates)
+    recipients = filtered_customers.groupby(target_column, observed=True, sort=False).head(max_emails_per_target)
+    
+    # Send in the background so the page keeps rendering; main() polls the future for progress and results
+    progress = {'done': 0, 'total': len(recipients)}
+    st.session_state.campaign_progress = progress
+    st.session_state.campaign_future = get_campaign_executor().submit(
+        run_real_campaign,
+        email_sender,
+        campaign_id,
+        recipients,
+        target_templates,
+        target_column,
+        progress
+    )
+    st.rerun()
 
 # Function to reset campaign
 def reset_campaign():
     st.session_state.campaign_setup_complete = False
     st.session_state.campaign_id = None
     st.session_state.campaign_summary = {}
-    st.session_state.filtered_customers = pd.DataFrame()
+    st.session_state.filtered_positions = np.array([], dtype=np.intp)
+    st.session_state.test_data_mtime = None
     st.session_state.selected_templates = {}
     st.session_state.email_preview_customer = {}
     st.session_state.campaign_executed = False
     st.session_state.test_mode = True
     st.session_state.execution_confirmed = False
+    st.session_state.recipients_page = 0
     if 'campaign_results' in st.session_state:
         del st.session_state.campaign_results
+    if 'campaign_future' in st.session_state:
+        del st.session_state.campaign_future
+    if 'default_campaign_name' in st.session_state:
+        del st.session_state.default_campaign_name
     st.rerun()
 
+# Gmail-specific guidance shown in the diagnostics
+GMAIL_SETUP_NOTE = """
+#### Gmail Configuration Note
+Since you're using Gmail, make sure you have:
+1. Enabled 2-Step Verification for your Google account
+2. Created an App Password:
+   - Go to your Google Account → Security → App Passwords
+   - Select 'Mail' as the app and your device
+   - Use the generated 16-character password in your .env file
+3. Make sure the password in .env does NOT have spaces
+"""
+
+# Function to build the email configuration summary (cached per configuration)
+@st.cache_data(show_spinner=False)
+def get_email_diagnostic_markdown(host, port, username, password_length):
+    """Build the diagnostics markdown; only the password length is passed, never the password"""
+    config_markdown = "\n\n".join([
+        "### Email Configuration",
+        f"**Host:** {host}",
+        f"**Port:** {port}",
+        f"**Username:** {username}",
+        f"**Password Length:** {password_length} characters"
+    ])
+    return config_markdown, "gmail.com" in username.lower()
+
+# Function to get a logged-in SMTP connection for the diagnostics, reusing a recent one
+def get_diagnostic_smtp_connection(email_host, email_port, email_user, email_password):
+    """Return a logged-in SMTP connection, reusing the session's last one while it is fresh and alive"""
+    connection_key = (email_host, email_port, email_user)
+    cached = st.session_state.get('diagnostic_smtp')
+    
+    if cached is not None:
+        key, server, connected_at = cached
+        if key == connection_key and time.time() - connected_at < DIAGNOSTIC_SMTP_REUSE_SECONDS:
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPServerDisconnected, OSError):
+                pass
+        
+        # Drop the stale connection before opening a new one
+        del st.session_state.diagnostic_smtp
+        try:
+            server.quit()
+        except Exception:
+            pass
+    
+    # Connect to SMTP server
+    if email_port == 465:
+        server = smtplib.SMTP_SSL(email_host, email_port)
+    else:
+        server = smtplib.SMTP(email_host, email_port)
+        server.starttls()
+    
+    # Login
+    server.login(email_user, email_password)
+    st.session_state.diagnostic_smtp = (connection_key, server, time.time())
+    return server
+
 # Function to show email diagnostic information
 def show_email_diagnostic():
     """Show diagnostic information for email configuration"""
     with st.expander("📧 Email Configuration Diagnostics"):
-        # Load environment variables
-        load_dotenv(override=True)
-        
         # Get email configuration from .env
-        email_host = os.getenv("EMAIL_HOST", "smtp.gmail.com")
-        email_port = int(os.getenv("EMAIL_PORT", "465"))
-        email_user = os.getenv("EMAIL_USER", "")
-        email_password = os.getenv("EMAIL_PASSWORD", "")
+        email_config = load_email_config()
+        email_host = email_config['host']
+        email_port = email_config['port']
+        email_user = email_config['username']
+        email_password = email_config['password']
         
         # Display configuration
-        st.write("### Email Configuration")
-        st.write(f"**Host:** {email_host}")
-        st.write(f"**Port:** {email_port}")
-        st.write(f"**Username:** {email_user}")
-        st.write(f"**Password Length:** {len(email_password) if email_password else 0} characters")
+        config_markdown, is_gmail = get_email_diagnostic_markdown(
+            email_host, email_port, email_user, len(email_password) if email_password else 0
+        )
+        st.markdown(config_markdown)
         
         # Gmail-specific guidance
-        if "gmail.com" in email_user.lower():
-            st.warning("""
-            #### Gmail Configuration Note
-            Since you're using Gmail, make sure you have:
-            1. Enabled 2-Step Verification for your Google account
-            2. Created an App Password:
-               - Go to your Google Account → Security → App Passwords
-               - Select 'Mail' as the app and your device
-               - Use the generated 16-character password in your .env file
-            3. Make sure the password in .env does NOT have spaces
-            """)
+        if is_gmail:
+            st.warning(GMAIL_SETUP_NOTE)
+        
+        # Pick up edits to .env without restarting the app
+        if st.button("Reload Email Configuration"):
+            load_email_config.clear()
+            get_email_sender.clear()
+            st.rerun()
         
         # Test connection button
         if st.button("Test Email Connection"):
             with st.spinner("Testing connection to email server..."):
                 try:
-                    # Connect to SMTP server
-                    if email_port == 465:
-                        server = smtplib.SMTP_SSL(email_host, email_port)
-                    else:
-                        server = smtplib.SMTP(email_host, email_port)
-                        server.starttls()
-                    
-                    # Login
-                    server.login(email_user, email_password)
+                    # Connect and log in, or check the connection from a recent test is still alive
+                    get_diagnostic_smtp_connection(email_host, email_port, email_user, email_password)
                     st.success("✅ Connection to email server successful!")
-                    server.quit()
                 except Exception as e:
                     st.error(f"❌ Connection failed: {str(e)}")
                     st.info("""
@@ -557,25 +749,23 @@ def main():
     Make sure you have added test customers in the Test Data Manager page before proceeding.
     """)
     
-    # Load environment variables
-    load_dotenv(override=True)
-    
     # Get email configuration from .env
-    email_host = os.getenv("EMAIL_HOST", "smtp.gmail.com")
-    email_port = int(os.getenv("EMAIL_PORT", "465"))
-    email_user = os.getenv("EMAIL_USER", "")
-    email_password = os.getenv("EMAIL_PASSWORD", "")
+    email_config = load_email_config()
+    email_host = email_config['host']
+    email_port = email_config['port']
+    email_user = email_config['username']
+    email_password = email_config['password']
     
-    # Load test data
-    test_data = load_test_data()
+    # Load test data as customer counts per segment and category, sorted by name
+    # Reruns only read these small cached series; the customers themselves are copied out of the cache on submit
+    test_data_counts = load_test_data_counts()
     
-    if test_data.empty:
+    if test_data_counts is None or test_data_counts[1].empty:
         st.warning("No test customer data found. Please add test customers in the Test Data Manager page first.")
         st.markdown("[Go to Test Data Manager](/Test_Data_Manager)")
         return
     
-    # Prepare test customer data for email templates
-    email_ready_customers = EmailTemplateManager.prepare_customer_data_for_email(test_data)
+    test_data_mtime, segment_counts, category_counts = test_data_counts
     
     # Check if campaign setup is complete
     if not st.session_state.campaign_setup_complete:
@@ -583,10 +773,12 @@ def main():
         with st.form(key="test_campaign_form"):
             st.markdown('<h2 class="sub-header">Test Campaign Setup</h2>', unsafe_allow_html=True)
             
-            # Campaign name
+            # Campaign name (default fixed when the form is first shown so it does not shift on reruns)
+            if 'default_campaign_name' not in st.session_state:
+                st.session_state.default_campaign_name = f"Test Campaign {datetime.now().strftime('%Y-%m-%d %H:%M')}"
             campaign_name = st.text_input(
                 "Campaign Name", 
-                f"Test Campaign {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+                st.session_state.default_campaign_name
             )
             
             # Target type
@@ -603,19 +795,17 @@ def main():
             
             # Select target based on type
             if target_type == "Segment-based":
-                if len(test_data['segment_name'].unique()) > 0:
-                    default_segment = [sorted(test_data['segment_name'].unique())[0]]
-                else:
-                    default_segment = []
+                segment_options = segment_counts.index.tolist()
+                default_segment = segment_options[:1]
                     
                 target_segments = st.multiselect(
                     "Target Segments",
-                    options=sorted(test_data['segment_name'].unique()),
+                    options=segment_options,
                     default=default_segment
                 )
                 
                 # Get segment templates
-                templates = EmailTemplateManager.get_segment_templates()
+                templates = load_segment_templates()
                 
                 # Filter templates for selected segments
                 selected_templates = {segment: templates[segment] for segment in target_segments if segment in templates}
@@ -624,23 +814,20 @@ def main():
                 if target_segments:
                     st.write("Target Customer Counts:")
                     for segment in target_segments:
-                        segment_count = len(test_data[test_data['segment_name'] == segment])
-                        st.write(f"- {segment}: {segment_count} customers")
+                        st.write(f"- {segment}: {segment_counts[segment]} customers")
                 
             else:  # Category-based
-                if len(test_data['primary_category'].unique()) > 0:
-                    default_category = [sorted(test_data['primary_category'].unique())[0]]
-                else:
-                    default_category = []
+                category_options = category_counts.index.tolist()
+                default_category = category_options[:1]
                     
                 target_categories = st.multiselect(
                     "Target Categories",
-                    options=sorted(test_data['primary_category'].unique()),
+                    options=category_options,
                     default=default_category
                 )
                 
                 # Get category templates
-                templates = EmailTemplateManager.get_category_templates()
+                templates = load_category_templates()
                 
                 # Convert database categories to display categories for templates
                 selected_templates = {}
@@ -653,8 +840,7 @@ def main():
                 if target_categories:
                     st.write("Target Customer Counts:")
                     for category in target_categories:
-                        category_count = len(test_data[test_data['primary_category'] == category])
-                        st.write(f"- {category}: {category_count} customers")
+                        st.write(f"- {category}: {category_counts[category]} customers")
             
             # Test mode option
             test_mode = st.checkbox("Test Mode (No emails will be sent)", value=True)
@@ -680,6 +866,9 @@ def main():
         
         # Handle form submission outside the form (but check for the form submission)
         if submit_button:
+            # Prepare test customer data for email templates
+            email_ready_customers = prepare_test_data_for_email(TEST_DATA_PATH, test_data_mtime)
+            
             # Handle form submission
             if target_type == "Segment-based":
                 handle_campaign_setup_form(
@@ -694,6 +883,7 @@ def main():
                     email_host=email_host,
                     email_port=email_port,
                     email_ready_customers=email_ready_customers,
+                    test_data_mtime=test_data_mtime,
                     selected_templates=selected_templates
                 )
             else:  # Category-based
@@ -709,6 +899,7 @@ def main():
                     email_host=email_host,
                     email_port=email_port,
                     email_ready_customers=email_ready_customers,
+                    test_data_mtime=test_data_mtime,
                     selected_templates=selected_templates
                 )
     
@@ -717,7 +908,6 @@ def main():
         # Get campaign info from session state
         campaign_summary = st.session_state.campaign_summary
         selected_templates = st.session_state.selected_templates
-        filtered_customers = st.session_state.filtered_customers
         
         st.success(f"Campaign '{campaign_summary['campaign_name']}' set up successfully!")
         
@@ -747,28 +937,80 @@ def main():
         # Campaign execution
         st.markdown("### Campaign Execution")
         
+        # Collect the results of a campaign sending in the background once it finishes
+        campaign_future = st.session_state.get('campaign_future')
+        if campaign_future is not None and campaign_future.done():
+            del st.session_state.campaign_future
+            try:
+                st.session_state.campaign_results = campaign_future.result()
+                st.session_state.campaign_executed = True
+            except Exception as e:
+                st.error(f"Error executing campaign: {str(e)}")
+            campaign_future = None
+        
+        # If campaign is still sending
+        if campaign_future is not None:
+            progress = st.session_state.campaign_progress
+            st.progress(
+                progress['done'] / progress['total'] if progress['total'] else 0.0,
+                text=f"Sent {progress['done']} of {progress['total']} emails"
+            )
+            
+            # Check again shortly; the sending itself happens off the script thread
+            time.sleep(1)
+            st.rerun()
+        
         # If campaign has been executed
-        if st.session_state.campaign_executed:
+        elif st.session_state.campaign_executed:
             if st.session_state.test_mode:
-                st.success(f"Test completed! {len(filtered_customers)} emails would be sent.")
+                st.success(f"Test completed! {len(st.session_state.filtered_positions)} emails would be sent.")
                 
-                # Show test recipients
+                # Show test recipients one page at a time; slicing the Arrow table does not copy it
                 st.markdown("#### Test Recipients")
-                st.dataframe(filtered_customers[['email', 'first_name', 'last_name', 'segment_name', 'primary_category']], use_container_width=True)
+                recipients_table = get_test_recipients_table(st.session_state.test_data_mtime, st.session_state.filtered_positions)
+                page_count = max(1, -(-recipients_table.num_rows // RECIPIENTS_PAGE_SIZE))
+                page = min(st.session_state.recipients_page, page_count - 1)
+                st.dataframe(
+                    recipients_table.slice(page * RECIPIENTS_PAGE_SIZE, RECIPIENTS_PAGE_SIZE),
+                    use_container_width=True
+                )
+                
+                if page_count > 1:
+                    col1, col2, col3 = st.columns([2, 8, 2])
+                    with col1:
+                        st.button("Previous", on_click=change_recipients_page, args=(-1,), disabled=page == 0)
+                    with col2:
+                        st.caption(f"Page {page + 1} of {page_count} ({recipients_table.num_rows} recipients)")
+                    with col3:
+                        st.button("Next", on_click=change_recipients_page, args=(1,), disabled=page == page_count - 1)
             else:
                 # Get results from session state
                 campaign_results = st.session_state.get('campaign_results', {})
                 
                 if campaign_results:
-                    st.success(f"Campaign executed successfully! {campaign_results.get('total_sent', 0)} emails sent.")
+                    if campaign_results.get('aborted'):
+                        st.warning(
+                            f"Campaign aborted after more than a third of the first sends failed. "
+                            f"{campaign_results.get('total_sent', 0)} emails sent; check the email configuration."
+                        )
+                    else:
+                        st.success(f"Campaign executed successfully! {campaign_results.get('total_sent', 0)} emails sent.")
                     
-                    # Show details of results
+                    # Show details of results in one table, read from the results saved with the campaign
+                    from src.email.campaign_manager import CampaignManager
+                    saved_results = CampaignManager().get_campaign_results(st.session_state.campaign_id)
                     st.markdown("#### Sending Results")
-                    for detail in campaign_results.get('details', []):
-                        if 'segment' in detail:
-                            st.info(f"**{detail['segment']}**: {detail['success']} sent, {detail['failed']} failed")
-                        else:
-                            st.info(f"**Summary**: {detail['success']} sent, {detail['failed']} failed")
+                    st.dataframe(
+                        pd.DataFrame(
+                            [
+                                (detail['segment'], detail['success'], detail['failed'])
+                                for detail in saved_results.get('details', [])
+                            ],
+                            columns=['Target', 'Sent', 'Failed']
+                        ),
+                        hide_index=True,
+                        use_container_width=True
+                    )
                 else:
                     st.info("Campaign execution results not available.")
         else:
@@ -779,29 +1021,23 @@ def main():
                 # Execute campaign button for test mode
                 st.button("Run Test Campaign", on_click=run_test_campaign)
             else:
-                # Create email sender to validate configuration
+                # Get the shared email sender to validate configuration
                 try:
-                    email_sender = EmailSender(
-                        host=email_host,
-                        port=email_port,
-                        username=email_user,
-                        password=email_password,
-                        enable_tracking=True
-                    )
+                    email_sender = get_email_sender(email_host, email_port, email_user, email_password)
                     
                     st.success("Email configuration validated successfully!")
                     
-                    # Confirmation checkbox - FIXED IMPLEMENTATION
-                    confirm = st.checkbox(
-                        "I confirm that I want to send these emails", 
-                        value=st.session_state.get('execution_confirmed', False),
-                        key="confirm_checkbox",
-                        on_change=handle_confirmation_change
-                    )
+                    # Confirmation and execute button in a form, so ticking the box does not rerun the page
+                    with st.form(key="execute_campaign_form"):
+                        confirm = st.checkbox(
+                            "I confirm that I want to send these emails", 
+                            value=st.session_state.get('execution_confirmed', False)
+                        )
+                        execute_button = st.form_submit_button("Execute Campaign")
                     
-                    # Execute button - directly check the current state
-                    if st.button("Execute Campaign", disabled=not st.session_state.get('execution_confirmed', False)):
-                        execute_real_campaign()
+                    if execute_button:
+                        st.session_state.execution_confirmed = confirm
+                        execute_real_campaign(email_sender)
                     
                 except Exception as e:
                     st.error(f"Email configuration error: {str(e)}")
@@ -24,6 +24,27 @@ def load_data(file_path: str) -> pd.DataFrame:
     return pd.read_csv(file_path)
 
 
+def clean_amount(series: pd.Series) -> pd.Series:
+    """
+    Convert a column of monetary amounts to float64.
+    
+    String values such as "₹1,234.50" are cleaned with a single vectorized
+    regex pass; unparseable values become NaN.
+    
+    Args:
+        series: Column of amounts (numeric or string)
+        
+    Returns:
+        float64 Series of amounts
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    
+    cleaned = series.astype(str).str.replace(r'[₹$,\s]', '', regex=True)
+    cleaned = cleaned.str.extract(r'^(-?\d+(?:\.\d+)?)', expand=False)
+    return pd.to_numeric(cleaned, errors='coerce').astype('float64')
+
+
 def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Preprocess raw transaction data.
@@ -67,6 +88,11 @@ def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
         max_date = processed_df['invoice_date'].max()
         processed_df['days_since_last_purchase'] = (max_date - processed_df['invoice_date']).dt.days
     
+    # Make sure monetary columns are numeric
+    for amount_col in ['price', 'total_amount']:
+        if amount_col in processed_df.columns:
+            processed_df[amount_col] = clean_amount(processed_df[amount_col])
+    
     # Handle missing values
     processed_df.fillna({
         'discount': 0,
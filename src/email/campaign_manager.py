@@ -180,6 +180,24 @@ class CampaignManager:
         
         return {}
     
+    def get_campaign_results(self, campaign_id: str) -> Dict:
+        """
+        Get saved campaign results by ID.
+        
+        Args:
+            campaign_id: Campaign ID
+            
+        Returns:
+            Campaign results
+        """
+        file_path = os.path.join(self.campaign_results_dir, f"{campaign_id}_results.json")
+        
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as file:
+                return json.load(file)
+        
+        return {}
+    
     def update_campaign_status(self, campaign_id: str, status: str, results: Optional[Dict] = None):
         """
         Update campaign status and results.
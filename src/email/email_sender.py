@@ -7,23 +7,86 @@ import pandas as pd
 import re
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 from email_validator import validate_email, EmailNotValidError
 from dotenv import load_dotenv
 import logging
 import numpy as np
+import functools
+import queue
+import string
+import threading
+import time
 
 # Import email tracker
 from src.email.email_tracker import EmailTracker
 
 
+@functools.lru_cache(maxsize=256)
+def get_template_fields(template: str) -> Tuple[str, ...]:
+    """
+    Get the names of the placeholders used in a template.
+    
+    Args:
+        template: Template string with {placeholders}
+        
+    Returns:
+        Tuple of unique top-level field names, in order of first use
+    """
+    fields = (
+        re.split(r'[.\[]', field_name, maxsplit=1)[0]
+        for _, field_name, _, _ in string.Formatter().parse(template)
+        if field_name
+    )
+    return tuple(dict.fromkeys(fields))
+
+
+class SendRateLimiter:
+    """
+    Thread-safe limiter that spaces out sends shared by several senders.
+    """
+    
+    def __init__(self, rate_limit: int, rate_delta: float = 1.0):
+        """
+        Initialize the SendRateLimiter class.
+        
+        Args:
+            rate_limit: Maximum number of sends per rate_delta seconds
+            rate_delta: Length of the rate window in seconds
+        """
+        self.interval = rate_delta / rate_limit
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until the next send slot is available."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class EmailSender:
     """
     Class for sending automated emails to customers.
     """
     
-    def __init__(self, host="localhost", port=25, username="", password="", enable_tracking=True, provider=None):
+    # Messages sent over one SMTP connection before it is reopened
+    MAX_MESSAGES_PER_CONNECTION = 500
+    # Most providers throttle accounts that open more parallel SMTP connections than this
+    MAX_CONCURRENCY = 10
+    # Idle time after which a pooled connection is checked with NOOP before reuse
+    IDLE_CHECK_SECONDS = 30
+    # SMTP replies that mean "try again later", retried with exponential backoff
+    TRANSIENT_SMTP_CODES = (421, 450, 454)
+    MAX_SEND_ATTEMPTS = 3
+    
+    def __init__(self, host="localhost", port=25, username="", password="", enable_tracking=True, provider=None,
+                 rate_limiter=None, concurrency=1):
         """
         Initialize the email sender with SMTP settings.
         
@@ -34,6 +97,8 @@ class EmailSender:
             password (str): SMTP password
             enable_tracking (bool): Whether to enable tracking of email opens and clicks
             provider (str, optional): Email provider (gmail, outlook, yahoo, etc.) to auto-configure settings
+            rate_limiter (SendRateLimiter, optional): Limiter shared with other senders
+            concurrency (int): Number of SMTP connections kept open for threads sharing this sender
         """
         # Auto-configure based on provider if specified
         if provider:
@@ -46,8 +111,14 @@ class EmailSender:
             
         self.enable_tracking = enable_tracking
         self.tracker = EmailTracker() if enable_tracking else None
+        self.rate_limiter = rate_limiter
         self.logger = self._setup_logger()
         
+        # Pool of SMTP connections kept open between sends, opened lazily up to the concurrency limit
+        self.concurrency = max(1, min(concurrency, self.MAX_CONCURRENCY))
+        self._idle_connections = queue.LifoQueue()
+        self._connection_slots = threading.BoundedSemaphore(self.concurrency)
+        
         # Determine connection type based on port
         self.use_ssl = (self.port == 465)
         
@@ -272,6 +343,137 @@ class EmailSender:
         
         return html_content
     
+    def _connect(self):
+        """
+        Open and authenticate a new SMTP connection.
+        
+        Returns:
+            Connected SMTP server
+        """
+        if self.use_ssl:
+            # Use SSL connection (port 465)
+            self.logger.info("Creating SMTP_SSL connection")
+            server = smtplib.SMTP_SSL(self.host, self.port)
+        else:
+            # Use TLS connection (port 587)
+            self.logger.info("Creating SMTP connection with STARTTLS")
+            server = smtplib.SMTP(self.host, self.port)
+            server.ehlo()
+            server.starttls()
+            server.ehlo()
+        
+        # Login if credentials provided
+        if self.username and self.password:
+            self.logger.info(f"Authenticating as {self.username}")
+            # Strip any whitespace from password that might have been accidentally included
+            clean_password = self.password.strip()
+            server.login(self.username, clean_password)
+        
+        return server
+    
+    @staticmethod
+    def _quit(server):
+        """Close an SMTP connection, ignoring errors from one that is already dead."""
+        try:
+            server.quit()
+        except smtplib.SMTPException:
+            pass
+        except OSError:
+            pass
+    
+    def _acquire_connection(self):
+        """
+        Take a connection from the pool, waiting while all of them are in use.
+        
+        Idle connections are checked with NOOP, and replaced when dead or used for too many messages.
+        
+        Returns:
+            Dictionary with the connected 'server' and its 'messages' count
+        """
+        self._connection_slots.acquire()
+        try:
+            try:
+                connection = self._idle_connections.get_nowait()
+            except queue.Empty:
+                connection = None
+            
+            if connection is not None and connection['messages'] >= self.MAX_MESSAGES_PER_CONNECTION:
+                self._quit(connection['server'])
+                connection = None
+            elif connection is not None and time.monotonic() - connection['last_used'] > self.IDLE_CHECK_SECONDS:
+                try:
+                    alive = connection['server'].noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    alive = False
+                if not alive:
+                    self._quit(connection['server'])
+                    connection = None
+            
+            if connection is None:
+                self.logger.info(f"Connecting to {self.host}:{self.port} {'with SSL' if self.use_ssl else 'with TLS'}")
+                connection = {'server': self._connect(), 'messages': 0}
+            
+            return connection
+        except Exception:
+            self._connection_slots.release()
+            raise
+    
+    def _release_connection(self, connection, reusable=True):
+        """
+        Return a connection to the pool, or close it if it can not be reused.
+        
+        Args:
+            connection: Connection taken with _acquire_connection
+            reusable: False when the connection failed and should be dropped
+        """
+        if reusable:
+            connection['last_used'] = time.monotonic()
+            self._idle_connections.put(connection)
+        else:
+            self._quit(connection['server'])
+        self._connection_slots.release()
+    
+    def _sendmail(self, connection, to_email, message):
+        """
+        Send a message over a pooled connection.
+        
+        Reconnects once if the server dropped the connection, and backs off when the server defers the message.
+        
+        Args:
+            connection: Connection taken with _acquire_connection
+            to_email: Recipient email address
+            message: Message as a string
+        """
+        for attempt in range(self.MAX_SEND_ATTEMPTS):
+            try:
+                try:
+                    connection['server'].sendmail(self.username, to_email, message)
+                except smtplib.SMTPServerDisconnected:
+                    connection['server'] = self._connect()
+                    connection['messages'] = 0
+                    connection['server'].sendmail(self.username, to_email, message)
+                connection['messages'] += 1
+                return
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code not in self.TRANSIENT_SMTP_CODES or attempt == self.MAX_SEND_ATTEMPTS - 1:
+                    raise
+                delay = 2 ** attempt
+                self.logger.warning(f"Server deferred email to {to_email} ({e.smtp_code}), retrying in {delay}s")
+                time.sleep(delay)
+    
+    def close(self):
+        """Close the idle SMTP connections in the pool."""
+        while True:
+            try:
+                connection = self._idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(connection['server'])
+    
+    def __del__(self):
+        if getattr(self, '_idle_connections', None) is not None:
+            self.close()
+    
     def send_email(self, to_email, subject, body_html, body_text=None, campaign_id=None, customer_id=None):
         """
         Send an email to a recipient with HTML content and optional tracking.
@@ -319,33 +521,18 @@ class EmailSender:
             html_part = MIMEText(body_html, 'html')
             msg.attach(html_part)
             
-            # Connect to SMTP server and send email
-            self.logger.info(f"Connecting to {self.host}:{self.port} {'with SSL' if self.use_ssl else 'with TLS'}")
+            # Wait for a send slot when sharing a rate limit with other senders
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
             
+            # Send over a pooled SMTP connection
+            connection = None
+            reusable = False
             try:
-                if self.use_ssl:
-                    # Use SSL connection (port 465)
-                    self.logger.info("Creating SMTP_SSL connection")
-                    server = smtplib.SMTP_SSL(self.host, self.port)
-                else:
-                    # Use TLS connection (port 587)
-                    self.logger.info("Creating SMTP connection with STARTTLS")
-                    server = smtplib.SMTP(self.host, self.port)
-                    server.ehlo()
-                    server.starttls()
-                    server.ehlo()
-                
-                # Login if credentials provided
-                if self.username and self.password:
-                    self.logger.info(f"Authenticating as {self.username}")
-                    # Strip any whitespace from password that might have been accidentally included
-                    clean_password = self.password.strip()
-                    server.login(self.username, clean_password)
-                
-                # Send email
+                connection = self._acquire_connection()
                 self.logger.info(f"Sending email to {to_email}")
-                server.sendmail(self.username, to_email, msg.as_string())
-                server.quit()
+                self._sendmail(connection, to_email, msg.as_string())
+                reusable = True
                 
                 # Log success
                 self.logger.info(f"Email sent successfully to {to_email}")
@@ -366,16 +553,19 @@ class EmailSender:
                 return False
                 
             except smtplib.SMTPSenderRefused as e:
+                reusable = True
                 self.logger.error(f"SMTP Sender Refused: {str(e)}")
                 print(f"The email server refused the sender address: {self.username}")
                 return False
                 
             except smtplib.SMTPRecipientsRefused as e:
+                reusable = True
                 self.logger.error(f"SMTP Recipients Refused: {str(e)}")
                 print(f"The email server refused the recipient address: {to_email}")
                 return False
                 
             except smtplib.SMTPDataError as e:
+                reusable = True
                 self.logger.error(f"SMTP Data Error: {str(e)}")
                 print(f"The server responded with an unexpected error code: {str(e)}")
                 return False
@@ -397,6 +587,10 @@ class EmailSender:
                 print(f"An unexpected error occurred: {str(e)}")
                 return False
                 
+            finally:
+                if connection is not None:
+                    self._release_connection(connection, reusable)
+                
         except Exception as e:
             self.logger.error(f"Error preparing email: {str(e)}")
             print(f"Error preparing email: {str(e)}")
@@ -436,20 +630,28 @@ class EmailSender:
         if max_emails is not None:
             customers = customers.head(max_emails)
         
+        # Placeholders used by the templates, resolved once for the whole batch
+        templates = [template for template in (subject_template, body_html_template, body_text_template) if template]
+        template_fields = list(dict.fromkeys(field for template in templates for field in get_template_fields(template)))
+        
+        # Walk plain dict records of just the needed columns instead of building a Series per row
+        columns = [column for column in dict.fromkeys(['email', 'customer_id', *template_fields]) if column in customers.columns]
+        
         # Send emails to each customer
-        for _, customer in customers.iterrows():
+        for customer in customers[columns].to_dict('records'):
             # Skip if email is missing
             if pd.isna(customer['email']):
                 results['skipped'] += 1
                 continue
             
-            # Format templates with customer data
+            # Format templates with only the customer fields they use
             try:
-                subject = subject_template.format(**customer.to_dict())
-                body_html = body_html_template.format(**customer.to_dict())
+                context = {field: customer[field] for field in template_fields if field in customer}
+                subject = subject_template.format_map(context)
+                body_html = body_html_template.format_map(context)
                 
                 if body_text_template:
-                    body_text = body_text_template.format(**customer.to_dict())
+                    body_text = body_text_template.format_map(context)
                 else:
                     body_text = None
                 
@@ -516,7 +718,7 @@ class EmailSender:
         results['other'] = {'success': 0, 'failed': 0, 'skipped': 0}
         
         # Group customers by segment
-        for segment, segment_df in customers.groupby(segment_column):
+        for segment, segment_df in customers.groupby(segment_column, observed=True):
             # Skip if no template for this segment
             if segment not in segment_templates:
                 print(f"No template found for segment: {segment}")
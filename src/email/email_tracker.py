@@ -9,12 +9,64 @@ import pandas as pd
 import json
 import uuid
 import base64
+import atexit
+import binascii
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 # Placeholder for a proper tracking server
 TRACKING_BASE_URL = "https://example.com/tracking"
 
+# Format of the timestamps written to the tracking files
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Columns of the tracking CSV files. Events stay in CSV because every flush appends rows to
+# the end of the file; Parquet files can not be appended to, so reads project columns instead.
+OPENS_COLUMNS = ['tracking_id', 'campaign_id', 'customer_id', 'email', 'timestamp']
+CLICKS_COLUMNS = ['tracking_id', 'campaign_id', 'customer_id', 'email', 'link_id', 'link_url', 'timestamp']
+
+# Serializes writes to the sends file from parallel senders
+_SENDS_LOCK = threading.Lock()
+
+# Columns needed to aggregate opens or clicks
+AGGREGATE_COLUMNS = ['campaign_id', 'customer_id', 'timestamp']
+
+
+def count_events_per_day(timestamps: pd.Series) -> pd.Series:
+    """
+    Count tracking events per calendar day.
+    
+    Args:
+        timestamps: Event timestamps
+        
+    Returns:
+        Series of event counts indexed by day (as datetime64)
+    """
+    days = pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT, cache=True).dt.floor('D')
+    return days.value_counts().sort_index()
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_tracking_url(encoded_url: str) -> str:
+    """
+    Decode the original link URL from a click tracking parameter.
+    
+    Args:
+        encoded_url: URL-safe base64 encoded link URL
+        
+    Returns:
+        Decoded link URL, or "unknown" if it cannot be decoded
+    """
+    try:
+        return base64.urlsafe_b64decode(encoded_url.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        return "unknown"
+
+
 class EmailTracker:
     """
     Class for tracking email opens and clicks.
@@ -43,16 +95,12 @@ class EmailTracker:
         """
         # Create opens file if it doesn't exist
         if not os.path.exists(self.opens_file):
-            opens_df = pd.DataFrame(columns=[
-                'tracking_id', 'campaign_id', 'customer_id', 'email', 'timestamp'
-            ])
+            opens_df = pd.DataFrame(columns=OPENS_COLUMNS)
             opens_df.to_csv(self.opens_file, index=False)
         
         # Create clicks file if it doesn't exist
         if not os.path.exists(self.clicks_file):
-            clicks_df = pd.DataFrame(columns=[
-                'tracking_id', 'campaign_id', 'customer_id', 'email', 'link_id', 'link_url', 'timestamp'
-            ])
+            clicks_df = pd.DataFrame(columns=CLICKS_COLUMNS)
             clicks_df.to_csv(self.clicks_file, index=False)
     
     def generate_tracking_pixel(self, campaign_id: str, customer_id: str, email: str) -> Tuple[str, str]:
@@ -134,29 +182,34 @@ class EmailTracker:
         Returns:
             True if successful, False otherwise
         """
-        try:
-            # Load existing opens
-            opens_df = pd.read_csv(self.opens_file)
-            
-            # Create new row
-            new_row = pd.DataFrame({
-                'tracking_id': [tracking_id],
-                'campaign_id': [campaign_id],
-                'customer_id': [customer_id],
-                'email': [email],
-                'timestamp': [datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
-            })
-            
-            # Append new row
-            opens_df = pd.concat([opens_df, new_row], ignore_index=True)
+        return self.record_opens_bulk([{
+            'tracking_id': tracking_id,
+            'campaign_id': campaign_id,
+            'customer_id': customer_id,
+            'email': email,
+            'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT)
+        }])
+    
+    def record_opens_bulk(self, events: List[Dict]) -> bool:
+        """
+        Record several email opens in a single write.
+        
+        Args:
+            events: List of open events keyed by the opens file columns
             
-            # Save updated CSV
-            opens_df.to_csv(self.opens_file, index=False)
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            # Append the new rows without rewriting the existing opens
+            pd.DataFrame(events, columns=OPENS_COLUMNS).to_csv(
+                self.opens_file, mode='a', header=False, index=False
+            )
             
             return True
         
         except Exception as e:
-            print(f"Error recording email open: {str(e)}")
+            print(f"Error recording email opens: {str(e)}")
             return False
     
     def record_click(self, tracking_id: str, campaign_id: str, customer_id: str, 
@@ -175,81 +228,148 @@ class EmailTracker:
         Returns:
             True if successful, False otherwise
         """
-        try:
-            # Load existing clicks
-            clicks_df = pd.read_csv(self.clicks_file)
-            
-            # Create new row
-            new_row = pd.DataFrame({
-                'tracking_id': [tracking_id],
-                'campaign_id': [campaign_id],
-                'customer_id': [customer_id],
-                'email': [email],
-                'link_id': [link_id],
-                'link_url': [link_url],
-                'timestamp': [datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
-            })
-            
-            # Append new row
-            clicks_df = pd.concat([clicks_df, new_row], ignore_index=True)
+        return self.record_clicks_bulk([{
+            'tracking_id': tracking_id,
+            'campaign_id': campaign_id,
+            'customer_id': customer_id,
+            'email': email,
+            'link_id': link_id,
+            'link_url': link_url,
+            'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT)
+        }])
+    
+    def record_clicks_bulk(self, events: List[Dict]) -> bool:
+        """
+        Record several email link clicks in a single write.
+        
+        Args:
+            events: List of click events keyed by the clicks file columns
             
-            # Save updated CSV
-            clicks_df.to_csv(self.clicks_file, index=False)
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            # Append the new rows without rewriting the existing clicks
+            pd.DataFrame(events, columns=CLICKS_COLUMNS).to_csv(
+                self.clicks_file, mode='a', header=False, index=False
+            )
             
             return True
         
         except Exception as e:
-            print(f"Error recording email click: {str(e)}")
+            print(f"Error recording email clicks: {str(e)}")
             return False
     
-    def get_open_stats(self, campaign_id: Optional[str] = None) -> pd.DataFrame:
+    def get_open_stats(self, campaign_id: Optional[str] = None,
+                       columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Get statistics on email opens.
         
         Args:
             campaign_id: Campaign ID (optional, if not provided returns stats for all campaigns)
+            columns: Columns to return (optional, other columns are not parsed)
             
         Returns:
             DataFrame with open statistics
         """
         try:
-            # Load opens
-            opens_df = pd.read_csv(self.opens_file)
+            # Load opens, parsing only the requested columns
+            usecols = None if columns is None else list(dict.fromkeys(['campaign_id', *columns]))
+            opens_df = pd.read_csv(self.opens_file, usecols=usecols)
             
             # Filter by campaign if provided
             if campaign_id:
                 opens_df = opens_df[opens_df['campaign_id'] == campaign_id]
             
-            return opens_df
+            return opens_df if columns is None else opens_df[list(columns)]
         
         except Exception as e:
             print(f"Error getting open statistics: {str(e)}")
             return pd.DataFrame()
     
-    def get_click_stats(self, campaign_id: Optional[str] = None) -> pd.DataFrame:
+    def get_click_stats(self, campaign_id: Optional[str] = None,
+                        columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Get statistics on email clicks.
         
         Args:
             campaign_id: Campaign ID (optional, if not provided returns stats for all campaigns)
+            columns: Columns to return (optional, other columns are not parsed)
             
         Returns:
             DataFrame with click statistics
         """
         try:
-            # Load clicks
-            clicks_df = pd.read_csv(self.clicks_file)
+            # Load clicks, parsing only the requested columns
+            usecols = None if columns is None else list(dict.fromkeys(['campaign_id', *columns]))
+            clicks_df = pd.read_csv(self.clicks_file, usecols=usecols)
             
             # Filter by campaign if provided
             if campaign_id:
                 clicks_df = clicks_df[clicks_df['campaign_id'] == campaign_id]
             
-            return clicks_df
+            return clicks_df if columns is None else clicks_df[list(columns)]
         
         except Exception as e:
             print(f"Error getting click statistics: {str(e)}")
             return pd.DataFrame()
     
+    def get_open_aggregates(self, campaign_id: Optional[str] = None) -> Dict:
+        """
+        Get aggregate statistics on email opens.
+        
+        Args:
+            campaign_id: Campaign ID (optional, if not provided aggregates all campaigns)
+            
+        Returns:
+            Dictionary with total opens, unique customers and opens per day
+        """
+        return self._get_aggregates(self.opens_file, campaign_id)
+    
+    def get_click_aggregates(self, campaign_id: Optional[str] = None) -> Dict:
+        """
+        Get aggregate statistics on email clicks.
+        
+        Args:
+            campaign_id: Campaign ID (optional, if not provided aggregates all campaigns)
+            
+        Returns:
+            Dictionary with total clicks, unique customers and clicks per day
+        """
+        return self._get_aggregates(self.clicks_file, campaign_id)
+    
+    def _get_aggregates(self, file_path: str, campaign_id: Optional[str] = None) -> Dict:
+        """
+        Aggregate a tracking file without loading its unused columns.
+        
+        Args:
+            file_path: Path to the opens or clicks file
+            campaign_id: Campaign ID (optional)
+            
+        Returns:
+            Dictionary with 'total', 'unique' and 'daily' entries
+        """
+        try:
+            events_df = pd.read_csv(file_path, usecols=AGGREGATE_COLUMNS)
+            
+            # Filter by campaign if provided
+            if campaign_id:
+                events_df = events_df[events_df['campaign_id'] == campaign_id]
+            
+            return {
+                'total': len(events_df),
+                'unique': events_df['customer_id'].nunique(dropna=False),
+                'daily': count_events_per_day(events_df['timestamp'])
+            }
+        
+        except Exception as e:
+            print(f"Error aggregating tracking data: {str(e)}")
+            return {
+                'total': 0,
+                'unique': 0,
+                'daily': pd.Series(dtype='int64', index=pd.DatetimeIndex([]))
+            }
+    
     def update_campaign_stats(self, campaign_id: str) -> Dict[str, int]:
         """
         Update statistics for a campaign.
@@ -260,15 +380,15 @@ class EmailTracker:
         Returns:
             Dictionary with updated statistics
         """
-        # Get open and click stats
-        opens_df = self.get_open_stats(campaign_id)
-        clicks_df = self.get_click_stats(campaign_id)
+        # Get the customers behind the open and click stats
+        opens_df = self.get_open_stats(campaign_id, columns=['customer_id'])
+        clicks_df = self.get_click_stats(campaign_id, columns=['customer_id'])
         
         # Count unique customers who opened emails
-        unique_opens = len(opens_df['customer_id'].unique())
+        unique_opens = opens_df['customer_id'].nunique(dropna=False)
         
         # Count unique customers who clicked links
-        unique_clicks = len(clicks_df['customer_id'].unique())
+        unique_clicks = clicks_df['customer_id'].nunique(dropna=False)
         
         return {
             'emails_opened': unique_opens,
@@ -287,32 +407,238 @@ class EmailTracker:
             True if successful, False otherwise
         """
         try:
-            # Create sends file if it doesn't exist
-            sends_file = os.path.join(self.data_dir, "sends.csv")
-            if not os.path.exists(sends_file):
-                sends_df = pd.DataFrame(columns=[
-                    'campaign_id', 'customer_id', 'timestamp'
-                ])
-                sends_df.to_csv(sends_file, index=False)
-            
-            # Load existing sends
-            sends_df = pd.read_csv(sends_file)
-            
-            # Create new row
-            new_row = pd.DataFrame({
-                'campaign_id': [campaign_id],
-                'customer_id': [customer_id if customer_id else "unknown"],
-                'timestamp': [datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
-            })
+            # Senders on several threads share the file, so write one at a time
+            with _SENDS_LOCK:
+                # Create sends file if it doesn't exist
+                sends_file = os.path.join(self.data_dir, "sends.csv")
+                if not os.path.exists(sends_file):
+                    sends_df = pd.DataFrame(columns=[
+                        'campaign_id', 'customer_id', 'timestamp'
+                    ])
+                    sends_df.to_csv(sends_file, index=False)
+                
+                # Create new row
+                new_row = pd.DataFrame({
+                    'campaign_id': [campaign_id],
+                    'customer_id': [customer_id if customer_id else "unknown"],
+                    'timestamp': [datetime.now().strftime(TIMESTAMP_FORMAT)]
+                })
+                
+                # Append new row without rewriting the existing sends
+                new_row.to_csv(sends_file, mode='a', header=False, index=False)
+                
+                return True
+        
+        except Exception as e:
+            print(f"Error tracking email sent: {str(e)}")
+            return False
+
+
+class TrackingEventBuffer:
+    """
+    Buffer for email opens and clicks that writes them to disk in batches.
+    """
+    
+    def __init__(self, tracker: EmailTracker,
+                 on_flush: Optional[Callable[[Dict[str, Dict[str, int]]], None]] = None,
+                 flush_interval: float = 2.0, max_pending: int = 100,
+                 max_cached_campaigns: int = 256, stats_ttl: float = 300.0):
+        """
+        Initialize the TrackingEventBuffer class.
+        
+        Args:
+            tracker: EmailTracker used to write the events
+            on_flush: Called with the updated stats of the campaigns that had events in a flush
+            flush_interval: Seconds to wait before writing buffered events
+            max_pending: Number of buffered events that triggers an immediate write
+            max_cached_campaigns: Number of campaigns whose unique customers are kept in memory
+            stats_ttl: Seconds after which a campaign's cached customers are reloaded from the tracking files
+        """
+        self.tracker = tracker
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_cached_campaigns = max_cached_campaigns
+        self.stats_ttl = stats_ttl
+        
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        
+        # Unique customers per campaign as (loaded at, sets), least recently flushed first;
+        # only touched by flush, which holds self._flush_lock
+        self._stats_cache: OrderedDict = OrderedDict()
+        
+        # Write whatever is still buffered when the process exits
+        atexit.register(self.flush)
+    
+    def add_open(self, tracking_id: str, campaign_id: str, customer_id: str, email: str):
+        """
+        Buffer an email open.
+        
+        Args:
+            tracking_id: Tracking ID
+            campaign_id: Campaign ID
+            customer_id: Customer ID
+            email: Customer email address
+        """
+        self._add('open', {
+            'tracking_id': tracking_id,
+            'campaign_id': campaign_id,
+            'customer_id': customer_id,
+            'email': email,
+            'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT)
+        })
+    
+    def add_click(self, tracking_id: str, campaign_id: str, customer_id: str, 
+                  email: str, link_id: str, link_url: str):
+        """
+        Buffer an email link click.
+        
+        Args:
+            tracking_id: Tracking ID
+            campaign_id: Campaign ID
+            customer_id: Customer ID
+            email: Customer email address
+            link_id: Link ID
+            link_url: Original link URL
+        """
+        self._add('click', {
+            'tracking_id': tracking_id,
+            'campaign_id': campaign_id,
+            'customer_id': customer_id,
+            'email': email,
+            'link_id': link_id,
+            'link_url': link_url,
+            'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT)
+        })
+    
+    def _add(self, kind: str, event: Dict):
+        """
+        Queue an event and schedule or trigger a flush.
+        
+        Args:
+            kind: 'open' or 'click'
+            event: Event row
+        """
+        with self._lock:
+            self._pending.append((kind, event))
+            flush_now = len(self._pending) >= self.max_pending
             
-            # Append new row
-            sends_df = pd.concat([sends_df, new_row], ignore_index=True)
+            if not flush_now:
+                self._schedule_flush()
+        
+        if flush_now:
+            self.flush()
+    
+    def _schedule_flush(self):
+        """Start the flush timer unless one is already running; the caller holds self._lock."""
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _campaign_stats(self, campaign_id: str, now: float) -> Dict[str, set]:
+        """
+        Get the unique openers and clickers of a campaign.
+        
+        Campaigns that are not cached, or were loaded more than stats_ttl seconds ago, are read
+        from the tracking files, which also picks up events recorded without this buffer.
+        
+        Args:
+            campaign_id: Campaign ID
+            now: Current time.monotonic() value
             
-            # Save updated CSV
-            sends_df.to_csv(sends_file, index=False)
+        Returns:
+            Dictionary of customer ID sets keyed by stat name
+        """
+        entry = self._stats_cache.get(campaign_id)
+        
+        if entry is None or now - entry[0] > self.stats_ttl:
+            opens_df = self.tracker.get_open_stats(campaign_id, columns=['customer_id'])
+            clicks_df = self.tracker.get_click_stats(campaign_id, columns=['customer_id'])
+            entry = (now, {
+                'emails_opened': set(opens_df['customer_id'].astype(str)) if 'customer_id' in opens_df else set(),
+                'emails_clicked': set(clicks_df['customer_id'].astype(str)) if 'customer_id' in clicks_df else set()
+            })
+            self._stats_cache[campaign_id] = entry
+        
+        # Keep the most recently flushed campaigns and drop the oldest beyond the limit
+        self._stats_cache.move_to_end(campaign_id)
+        while len(self._stats_cache) > self.max_cached_campaigns:
+            self._stats_cache.popitem(last=False)
+        
+        return entry[1]
+    
+    def _count_written_events(self, events: List[Tuple[str, Dict]]) -> Dict[str, Dict[str, int]]:
+        """
+        Count events that are now on disk towards their campaigns' unique openers and clickers.
+        
+        Args:
+            events: Written (kind, event) pairs
             
-            return True
+        Returns:
+            Dictionary of opened and clicked counts keyed by campaign ID
+        """
+        now = time.monotonic()
+        touched = {}
         
-        except Exception as e:
-            print(f"Error tracking email sent: {str(e)}")
-            return False 
\ No newline at end of file
+        for kind, event in events:
+            stats = touched.get(event['campaign_id'])
+            if stats is None:
+                stats = touched[event['campaign_id']] = self._campaign_stats(event['campaign_id'], now)
+            stats['emails_opened' if kind == 'open' else 'emails_clicked'].add(str(event['customer_id']))
+        
+        return {
+            campaign_id: {key: len(customers) for key, customers in stats.items()}
+            for campaign_id, stats in touched.items()
+        }
+    
+    def flush(self) -> bool:
+        """
+        Write all buffered events to disk.
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        with self._flush_lock:
+            # Take the queued events and reset the timer
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                events = list(self._pending)
+                self._pending.clear()
+            
+            if not events:
+                return True
+            
+            opens = [('open', event) for kind, event in events if kind == 'open']
+            clicks = [('click', event) for kind, event in events if kind == 'click']
+            
+            written, failed = [], []
+            if opens:
+                (written if self.tracker.record_opens_bulk([event for _, event in opens]) else failed).extend(opens)
+            if clicks:
+                (written if self.tracker.record_clicks_bulk([event for _, event in clicks]) else failed).extend(clicks)
+            
+            # Keep events that could not be written at the front of the queue for the next flush
+            if failed:
+                print(f"Error writing {len(failed)} tracking events; they stay buffered and will be retried")
+                with self._lock:
+                    self._pending.extendleft(reversed(failed))
+                    self._schedule_flush()
+            
+            # Count only written events, so stored campaign stats never run ahead of the files,
+            # and report them once per campaign rather than once per event
+            # (this runs on the timer thread, so errors are reported here instead of raised)
+            if written:
+                try:
+                    campaign_stats = self._count_written_events(written)
+                    if self.on_flush:
+                        self.on_flush(campaign_stats)
+                except Exception as e:
+                    print(f"Error reporting tracking stats: {str(e)}")
+            
+            return not failed